@@ -0,0 +1,198 @@
+# coding:utf-8
+import sys
+import os
+import time
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+from PyQt6.QtGui import QImage, QPixmap
+from PyQt6.QtWidgets import QApplication
+
+from ui.VideoPlayer import VideoManager, highlight_color, point_color
+
+
+# The render path before the composition pipeline, frozen here so that the baseline does not follow later changes
+# of VideoManager. Only the decoder (get_origin_frame, which counts decodes) and the frame cache are shared, every
+# helper decodes and resizes its own copy of the frame
+def legacy_pure_frame(video, index):
+    frame = video.frame_cache.get(index)
+    if frame is None:
+        frame = video.get_origin_frame(index)
+        frame = cv2.resize(frame, (video.scaling_size[1], video.scaling_size[0]))
+        video.frame_cache.put(index, frame)
+    return frame.copy()
+
+
+def legacy_highlighted_labeled_frame(video, frame_index, annotation_index, only_inner_circle=False, inner_size=4):
+    frame = legacy_pure_frame(video, frame_index)
+    if frame_index not in video.keyframes_list:
+        return frame
+    try:
+        annotation = video.annotation_list[str(frame_index)]
+    except:
+        return frame
+    scaling = video.scaling
+    for index, pt in enumerate(annotation):
+        if pt is not None:
+            pt = (int(pt[0] * scaling), int(pt[1] * scaling))
+            if index == annotation_index:
+                cv2.circle(frame, pt, inner_size, highlight_color, 1)
+                if not only_inner_circle:
+                    cv2.circle(frame, pt, 10, highlight_color, 2)
+            else:
+                cv2.circle(frame, pt, 3, point_color, 1)
+                if not only_inner_circle:
+                    cv2.circle(frame, pt, 8, point_color, 2)
+    return frame
+
+
+def legacy_zoomin_frame(video, frame_index, annotation_index, zoom_scale=5):
+    black_frame = np.zeros((video.scaling_size[0], video.scaling_size[1], 3), dtype=np.uint8)
+    if frame_index not in video.keyframes_list:
+        return black_frame
+    scaling = video.scaling
+    frame = legacy_highlighted_labeled_frame(video, frame_index, annotation_index, only_inner_circle=True,
+                                             inner_size=2)
+    try:
+        annotation = video.annotation_list[str(frame_index)][annotation_index]
+    except:
+        return black_frame
+    if annotation is None:
+        return black_frame
+    annotation_fix = (int(annotation[0] * scaling), int(annotation[1] * scaling))
+    # Calculate the clipping size
+    append_height = int(1.0 * video.scaling_size[0] / zoom_scale / 2)
+    append_width = int(1.0 * video.scaling_size[1] / zoom_scale / 2)
+    # Determine the cropping position
+    x_left = annotation_fix[0] - append_width
+    x_right = annotation_fix[0] + append_width + 1
+    y_up = annotation_fix[1] - append_height
+    y_down = annotation_fix[1] + append_height + 1
+    # Correct the clipping position
+    if x_left < 0:
+        x_right -= x_left
+        x_left = 0
+    if x_right > video.scaling_size[1]:
+        fix = x_right - video.scaling_size[1]
+        x_left -= fix
+        x_right -= fix
+    if y_up < 0:
+        y_down -= y_up
+        y_up = 0
+    if y_down > video.scaling_size[0]:
+        fix = y_down - video.scaling_size[0]
+        y_up -= fix
+        y_down -= fix
+    # Crop picture
+    crop_frame = frame[y_up:y_down, x_left:x_right]
+    return cv2.resize(crop_frame, (video.scaling_size[1], video.scaling_size[0]))
+
+
+def legacy_begin_frame_index(video):
+    for index in video.keyframes_list:
+        if video.annotation_list.get(str(index)) is not None:
+            return index
+    return None
+
+
+# Highlighted view with both close-ups, as __getitem__ rendered it: the main view and each close-up decode the frame
+def legacy_render(video, frame_index, annotation_index):
+    frame_main = legacy_highlighted_labeled_frame(video, frame_index, annotation_index)
+    if video.show_frame_index:
+        frame_main = cv2.putText(frame_main, str(frame_index), (0 + 20, 0 + 40), cv2.FONT_HERSHEY_SIMPLEX,
+                                 1, (0, 0, 255), 2)
+    if video.show_annotation_index and frame_index in video.keyframes_list:
+        frame_main = cv2.putText(frame_main, str(annotation_index), (0 + 20, video.scaling_size[0] - 20),
+                                 cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    frame_beg_index = legacy_begin_frame_index(video)
+    if frame_beg_index is not None:
+        frame_beg = legacy_zoomin_frame(video, frame_beg_index, annotation_index)
+    else:
+        frame_beg = np.zeros((video.scaling_size[0], video.scaling_size[1], 3), dtype=np.uint8)
+    frame_now = legacy_zoomin_frame(video, frame_index, annotation_index)
+    concat_frame = cv2.vconcat([frame_beg, frame_now])
+    concat_frame = cv2.resize(concat_frame, (video.scaling_size[1] // 2, video.scaling_size[0]))
+    return cv2.hconcat([frame_main, concat_frame])
+
+
+# Count source frame decodes per rendered frame, with the frame caches disabled
+def benchmark_decodes(video_path, log_path):
+    video = VideoManager(video_path, log_path, cache_size=0, origin_cache_size=0)
+    video.set_show_context(True)
+    frame_list = video.get_keyframe_list()
+    # Label one point in the middle of every keyframe, so that both close-ups are shown
+    for frame_index in frame_list:
+        video.set_annotation(frame_index, 0, (video.scaling_size[1] // 2, video.scaling_size[0] // 2))
+    result = {}
+    for name, render in [('legacy', legacy_render), ('composed', lambda v, f, a: v[f, a])]:
+        video.decode_count = 0
+        for frame_index in frame_list:
+            render(video, frame_index, 0)
+        result[name] = video.decode_count / len(frame_list)
+        print('{:<10} {:.2f} decodes per rendered keyframe'.format(name, result[name]))
+    return result
+
+
+# Count decodes while a point is nudged with the arrow keys, the overlay is redrawn on the held frame
+def benchmark_nudge(video_path, log_path, step_num=100):
+    video = VideoManager(video_path, log_path, cache_size=0, origin_cache_size=0)
+    video.set_show_context(True)
+    frame_index = video.get_keyframe_list()[1]
+    video.set_annotation(frame_index, 0, (video.scaling_size[1] // 2, video.scaling_size[0] // 2))
+    video[frame_index, 0]
+    video.decode_count = 0
+    for step in range(step_num):
+        video.fix_annotation(frame_index, 0, direction=step % 4, step=1)
+        video[frame_index, 0]
+    print('{:<10} {} decodes for {} nudges'.format('nudge', video.decode_count, step_num))
+    return video.decode_count
+
+
+# Display path before the reused display buffer: concatenated frame, QImage and QPixmap on every repaint
+def legacy_display(video, frame_index, annotation_index):
+    frame = legacy_render(video, frame_index, annotation_index)
+    height, width, c = frame.shape
+    image = QImage(frame.data, width, height, c * width, QImage.Format.Format_BGR888)
+    return QPixmap.fromImage(image)
+
+
+# Measure milliseconds and transient allocations (traced by tracemalloc) per displayed frame, with warm caches
+def benchmark_display(video_path, log_path, frame_num=100):
+    video = VideoManager(video_path, log_path)
+    video.set_show_context(True)
+    frame_list = [index % len(video) for index in range(frame_num)]
+    for frame_index in video.get_keyframe_list():
+        video.set_annotation(frame_index, 0, (video.scaling_size[1] // 2, video.scaling_size[0] // 2))
+    canvas = np.empty(video.get_canvas_shape(), dtype=np.uint8)
+    display_list = [('legacy', lambda f: legacy_display(video, f, 0)),
+                    ('buffer', lambda f: video.render(f, 0, canvas))]
+    result = {}
+    for name, display in display_list:
+        for frame_index in frame_list:
+            display(frame_index)
+        begin = time.perf_counter()
+        for frame_index in frame_list:
+            display(frame_index)
+        elapsed = time.perf_counter() - begin
+        tracemalloc.start()
+        peak = 0
+        for frame_index in frame_list:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            display(frame_index)
+            peak += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        result[name] = (elapsed * 1000 / frame_num, peak / frame_num / 1024 / 1024)
+        print('{:<10} {:.2f} ms, {:.2f} MB allocated per frame'.format(name, *result[name]))
+    return result
+
+
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    video_path = sys.argv[1] if len(sys.argv) > 1 else './dataset/classification/0/test.mp4'
+    log_path = os.path.join(tempfile.mkdtemp(), 'benchmark.json')
+    benchmark_decodes(video_path, log_path)
+    benchmark_nudge(video_path, log_path)
+    benchmark_display(video_path, log_path)
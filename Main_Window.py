@@ -1,6 +1,7 @@
 # coding:utf-8
 import sys
 import shutil
+import multiprocessing
 from tqdm import tqdm
 import os
 import json
@@ -18,10 +19,14 @@ from qfluentwidgets import FluentIcon as FIF
 from ui.AnnotationIndicator import IndicatorPanel
 from ui.VideoPlayer import VideoFramePlayer
 from ui.VideoGroupManager import VideoGroupManager
+from ui.VideoProxy import ProxyBuilder
 from ui.AnnotationIndicator import Status as LightStatus
 from ui.PromptEditor import PromptEditor
-from ui.VideoGroupManager import DatasetLoader
-from ui.VideoPlayer import VideoManager
+from ui.VideoGroupManager import DatasetLoader, MergedDataset
+from ui.VideoPlayer import VideoManager, load_annotations
+from ui.VideoMeta import VideoOpenError, get_keyframes_list, load_log_data
+from ui.DatasetProber import DatasetProber
+from ui.AnnotationIndex import find_incomplete_keyframe
 from ui.SettingPage import SettingPage
 
 
@@ -30,13 +35,7 @@ direction_list = ['left']
 
 class Exporter:
     def __init__(self, data_path_list):
-        data_loader = None
-        for data_path in data_path_list:
-            if data_loader is None:
-                data_loader = DatasetLoader(data_path)
-            else:
-                data_loader = data_loader + DatasetLoader(data_path)
-        self.data_loader = data_loader
+        self.data_loader = MergedDataset([DatasetLoader(data_path) for data_path in data_path_list])
 
     def export(self, output_path):
         if os.path.exists(output_path):
@@ -46,8 +45,7 @@ class Exporter:
             for sample in self.data_loader:
                 # Get the original file path
                 video_path = sample['sample_path']
-                log_path = video_path.replace('.mp4', '.json')
-                log_path = log_path.replace('classification', 'log')
+                log_path = sample['log_path']
                 calib_file_path = './ui/calib.json'
                 # Classpath construction
                 output_class_path = os.path.join(output_path, str(sample['class_index']))
@@ -68,17 +66,31 @@ class Exporter:
                     segmentation_path = os.path.join(seq_path, 'segmentation')
                     if not os.path.exists(segmentation_path):
                         os.mkdir(segmentation_path)
-                    # Get video information and save the video
-                    video = VideoManager(video_path, log_path)
-                    video_len = len(video)
-                    fps = video.fps
+                    # Get video information and the labels, from the metadata probed into the manifest when
+                    # there is some. Old-version logs need the display size of the video to be converted
+                    meta = sample['meta']
+                    if meta is not None:
+                        video_len, fps = meta['length'], meta['fps']
+                        point_annotation, prompt_annotation, old_version = \
+                            load_annotations(load_log_data(log_path), get_keyframes_list(video_len))
+                        if old_version:
+                            meta = None
+                    if meta is None:
+                        video = VideoManager(video_path, log_path)
+                        video_len = len(video)
+                        fps = video.fps
+                        point_annotation = video.get_annotation_list()
+                        prompt_annotation = video.get_annotation_prompt()
+                        video.release()
                     duration = int(video_len * 1000.0 / fps)
-                    video_output_name = '{:0>8d}ms-{:0>8d}ms-visible.mp4'.format(0, duration)
+                    video_output_name = '{:0>8d}ms-{:0>8d}ms-visible'.format(0, duration)
                     video_output_path = os.path.join(frames_path, video_output_name)
-                    shutil.copyfile(video_path, video_output_path)
-                    # Get the label and save it
-                    point_annotation = video.get_annotation_list()
-                    prompt_annotation = video.get_annotation_prompt()
+                    # Frame folders are copied as they are, videos keep their extension
+                    if os.path.isdir(video_path):
+                        shutil.copytree(video_path, video_output_path)
+                    else:
+                        shutil.copyfile(video_path, video_output_path + os.path.splitext(video_path)[1])
+                    # Save the label
                     point_annotation_output_path = os.path.join(segmentation_path, 'labels.json')
                     prompt_annotation_output_path = os.path.join(segmentation_path, 'texts.json')
                     with open(point_annotation_output_path, 'w') as f:
@@ -106,6 +118,7 @@ class CustomTitleBar(MSFluentTitleBar):
     Clear = pyqtSignal()
     Export = pyqtSignal()
     PromptEditor = pyqtSignal()
+    NextIncomplete = pyqtSignal()
 
     def __init__(self, parent):
         super().__init__(parent)
@@ -144,6 +157,7 @@ class CustomTitleBar(MSFluentTitleBar):
         ])
         menu.addSeparator()
         menu.addActions([
+            QAction('Next Incomplete', triggered=self.NextIncomplete, shortcut='Ctrl+J'),
             QAction('Prompt Editor', triggered=self.PromptEditor, shortcut='Ctrl+P')
         ])
         button.setMenu(menu)
@@ -205,6 +219,7 @@ class MainWindow(MSFluentWindow):
         self.titleColumn.Clear.connect(self._annotation_canceled)
         self.titleColumn.Export.connect(self._export)
         self.titleColumn.PromptEditor.connect(self._open_prompt_widget)
+        self.titleColumn.NextIncomplete.connect(self._jump_to_incomplete)
         self.titleColumn.closeBtn.clicked.connect(self.promptEditor.close)
         self.titleColumn.setting_button.clicked.connect(self._open_setting_widget)
 
@@ -240,6 +255,7 @@ class MainWindow(MSFluentWindow):
         self.save_shortcut = QShortcut(QKeySequence(QKeySequence.StandardKey.Save), self)
         self.prompt_editor_shortcut = QShortcut(QKeySequence("Ctrl+P"), self)
         self.export_shortcut = QShortcut(QKeySequence("Ctrl+E"), self)
+        self.next_incomplete_shortcut = QShortcut(QKeySequence("Ctrl+J"), self)
         self.clear_shortcut = QShortcut("Delete", self)
 
         self.up_shortcut = QShortcut(QKeySequence("UP"), self)
@@ -253,6 +269,7 @@ class MainWindow(MSFluentWindow):
         self.save_shortcut.activated.connect(self._save_annotation)
         self.clear_shortcut.activated.connect(self._annotation_canceled)
         self.export_shortcut.activated.connect(self._export)
+        self.next_incomplete_shortcut.activated.connect(self._jump_to_incomplete)
         self.prompt_editor_shortcut.activated.connect(self.promptEditor.show)
 
         self.up_shortcut.activated.connect(self._annotation_fix_up)
@@ -264,6 +281,20 @@ class MainWindow(MSFluentWindow):
         self.folder_path_list = []
 
         self.simplify_annotation_setting = 'Off'
+        self.proxy_setting = 'Off'
+        self.disk_cache_setting = 'Off'
+        self.crop_borders_setting = 'Off'
+
+        # Proxy videos are built in the background while the proxy setting is on
+        self.proxyBuilder = ProxyBuilder(self)
+        self.proxyBuilder.ProxyReady.connect(self.videoFramePlayer.attach_proxy)
+        QApplication.instance().aboutToQuit.connect(self.proxyBuilder.stop)
+        QApplication.instance().aboutToQuit.connect(self.videoGroupManager.stop_prefetch)
+        # Metadata of every video is probed into the dataset manifests in the background
+        self.datasetProber = DatasetProber(self)
+        self.datasetProber.MetaProbed.connect(self.videoGroupManager.meta_probed)
+        QApplication.instance().aboutToQuit.connect(self.datasetProber.stop)
+        QApplication.instance().aboutToQuit.connect(self.videoGroupManager.stop_index)
 
     # Create a pop-up message
     def createWarningInfoBar(self, title, content):
@@ -297,14 +328,18 @@ class MainWindow(MSFluentWindow):
         if folder_path:
             self.folder_path_list = [folder_path]
             self.videoGroupManager.load_dataset(folder_path)
+            self._request_proxy()
+            self.datasetProber.request(self.videoGroupManager.dataset.roots[-1])
 
     # Add data
     def _add_video(self, folder_path=None):
         if folder_path is None:
             folder_path = QFileDialog.getExistingDirectory(None, "Select dataset folder")
-        if folder_path and (folder_path not in self.folder_path_list):
+        # The same root under another spelling of its path is not added again
+        if folder_path and (folder_path not in self.folder_path_list) and self.videoGroupManager.add_dataset(folder_path):
             self.folder_path_list.append(folder_path)
-            self.videoGroupManager.add_dataset(folder_path)
+            self._request_proxy()
+            self.datasetProber.request(self.videoGroupManager.dataset.roots[-1])
 
     # Save annotation
     def _save_annotation(self):
@@ -313,6 +348,8 @@ class MainWindow(MSFluentWindow):
         self._save_annotation_for_prompt()
         annotation_list = self.videoFramePlayer.get_all_annotation()
         annotation_prompt = self.videoFramePlayer.get_all_prompt_annotation()
+        if annotation_list is None:
+            return
         self.videoGroupManager.save_annotation_log(annotation_list, annotation_prompt)
 
     def _load_annotation_for_prompt(self):
@@ -341,6 +378,31 @@ class MainWindow(MSFluentWindow):
             return
         self.videoFramePlayer.set_prompt_annotation(frame_index=frame_index, annotation_index=annotation_index, annotation=annotation)
 
+    # Jump to the next keyframe of the current video that is not fully labeled, then to the first one of the next
+    # incomplete video
+    def _jump_to_incomplete(self):
+        if self.videoGroupManager.dataset is None:
+            return
+        annotation_list = self.videoFramePlayer.get_all_annotation()
+        if annotation_list is not None:
+            keyframe = find_incomplete_keyframe(annotation_list, self.videoFramePlayer.get_all_prompt_annotation(),
+                                                after=self.videoFramePlayer.current_frame)
+            if keyframe is not None:
+                self.videoFramePlayer.set_current_frame(keyframe)
+                return
+        # Switching saves the current video. It is searched after the others, from its first keyframe
+        index = self.videoGroupManager.next_incomplete_video()
+        if index is None:
+            InfoBar.success(title='Done', content='Every video is fully annotated.', orient=Qt.Orientation.Horizontal,
+                            isClosable=False, position=InfoBarPosition.TOP_RIGHT, duration=2000, parent=self)
+            return
+        self.videoGroupManager.switch_to(index)
+        annotation_list = self.videoFramePlayer.get_all_annotation()
+        if annotation_list is not None:
+            keyframe = find_incomplete_keyframe(annotation_list, self.videoFramePlayer.get_all_prompt_annotation())
+            if keyframe is not None:
+                self.videoFramePlayer.set_current_frame(keyframe)
+
     # Export
     def _export(self, output_path=None):
         if not len(self.folder_path_list):
@@ -359,7 +421,9 @@ class MainWindow(MSFluentWindow):
     def _open_setting_widget(self):
         auto_fill_setting = self.videoFramePlayer.get_auto_fill_setting()
         self.settingPage.show()
-        self.settingPage.set_setting({'Auto Fill:': auto_fill_setting, 'Simplify Annotation:': self.simplify_annotation_setting})
+        self.settingPage.set_setting({'Auto Fill:': auto_fill_setting, 'Simplify Annotation:': self.simplify_annotation_setting,
+                                      'Proxy Video:': self.proxy_setting, 'Disk Cache:': self.disk_cache_setting,
+                                      'Crop Borders:': self.crop_borders_setting})
 
     # Save setting
     def _save_setting(self, setting_dict):
@@ -372,11 +436,35 @@ class MainWindow(MSFluentWindow):
         else:
             self.promptEditor.lock_for_save(False)
             self.annotationIndicator.lock_for_safe(False)
+        self.crop_borders_setting = setting_dict['Crop Borders:']
+        self.videoFramePlayer.set_crop_borders(self.crop_borders_setting == 'On')
+        self.disk_cache_setting = setting_dict['Disk Cache:']
+        self.videoFramePlayer.set_use_disk_cache(self.disk_cache_setting == 'On')
+        self.proxy_setting = setting_dict['Proxy Video:']
+        self.videoFramePlayer.set_use_proxy(self.proxy_setting == 'On')
+        if self.proxy_setting == 'On':
+            self._request_proxy()
+        else:
+            self.proxyBuilder.clear()
+
+    # Queue proxies of the whole dataset, the current video first
+    def _request_proxy(self):
+        if self.proxy_setting != 'On' or self.videoGroupManager.dataset is None:
+            return
+        self.proxyBuilder.request([self.videoGroupManager[index] for index in range(len(self.videoGroupManager))])
+        self.proxyBuilder.prioritize(*self.videoGroupManager[self.videoGroupManager.current_video_index])
 
     # Video change slot function
     def _video_changed(self, index):
         video_path, log_path = self.videoGroupManager[index]
-        self.videoFramePlayer.load_video(video_path=video_path, log_path=log_path)
+        if self.proxy_setting == 'On':
+            self.proxyBuilder.prioritize(video_path, log_path)
+        try:
+            self.videoFramePlayer.load_video(video_path=video_path, log_path=log_path,
+                                             prefetched=self.videoGroupManager.take_prefetched(index))
+        except VideoOpenError as e:
+            self.annotationIndicator.remake(react=False)
+            self.createWarningInfoBar(title='Broken video', content=str(e))
         # annotation = self.videoFramePlayer.get_annotation(0)
         # self.annotationIndicator.remake(react=False)
         # self.annotationIndicator.load_annotation_list(annotation)
@@ -483,6 +571,8 @@ class MainWindow(MSFluentWindow):
 
 
 if __name__ == '__main__':
+    # Needed by the decoder process in frozen builds
+    multiprocessing.freeze_support()
     # setTheme(Theme.DARK)
 
     app = QApplication(sys.argv)
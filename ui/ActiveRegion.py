@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+from ui.VideoMeta import load_sidecar, update_sidecar
+
+# Frames sampled to find the active region of a video
+active_region_samples = 12
+# Pixels darker than this in every sample belong to the black border
+active_region_threshold = 20
+# The region is not cropped if it covers more of the frame than this, or less than the minimum
+active_region_max_fraction = 0.95
+active_region_min_fraction = 0.1
+# Margin kept around the region, relative to its size
+active_region_margin = 0.01
+
+
+# Find the field of view of endoscope footage: the bounding box (x, y, width, height) of the largest area that
+# is bright in some sampled frame. Text overlays in the border are separate areas and are left out.
+# None is returned when there is no border worth cropping
+def detect_active_region(source, sample_num=active_region_samples):
+    length = len(source)
+    index_list = sorted(set(int(i * (length - 1) / max(sample_num - 1, 1)) for i in range(sample_num)))
+    brightest = None
+    for index in index_list:
+        frame = source.read(index)
+        if frame is None:
+            continue
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        brightest = gray if brightest is None else np.maximum(brightest, gray)
+    if brightest is None:
+        return None
+    mask = (cv2.medianBlur(brightest, 5) > active_region_threshold).astype(np.uint8)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+    if count < 2:
+        return None
+    label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    x, y, w, h = [int(v) for v in stats[label, :4]]
+    height, width = brightest.shape
+    margin_x, margin_y = int(w * active_region_margin), int(h * active_region_margin)
+    x_left, y_up = max(x - margin_x, 0), max(y - margin_y, 0)
+    x_right, y_down = min(x + w + margin_x, width), min(y + h + margin_y, height)
+    fraction = (x_right - x_left) * (y_down - y_up) / (width * height)
+    if not active_region_min_fraction <= fraction <= active_region_max_fraction:
+        return None
+    return [x_left, y_up, x_right - x_left, y_down - y_up]
+
+
+# Load the active region from the sidecar, or detect and store it
+def load_active_region(source, video_path, log_path):
+    sidecar = load_sidecar(video_path, log_path)
+    if 'active_region' in sidecar:
+        return sidecar['active_region']
+    active_region = detect_active_region(source)
+    update_sidecar(video_path, log_path, active_region=active_region)
+    return active_region
+
+
+# Cut the active region out of a frame, given in original pixels. Frames of another size, e.g. from a proxy,
+# are cut at the same relative position. A view is returned, nothing is copied
+def crop_active_region(frame, active_region, ori_size):
+    if active_region is None:
+        return frame
+    x, y, w, h = active_region
+    if frame.shape[0] != ori_size[0] or frame.shape[1] != ori_size[1]:
+        scale_y = frame.shape[0] / ori_size[0]
+        scale_x = frame.shape[1] / ori_size[1]
+        x, y = int(round(x * scale_x)), int(round(y * scale_y))
+        w, h = max(int(round(w * scale_x)), 1), max(int(round(h * scale_y)), 1)
+    return frame[y:y + h, x:x + w]
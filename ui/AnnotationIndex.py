@@ -0,0 +1,195 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from ui.VideoMeta import get_keyframes_list, load_log_data
+
+# Processes reading the logs of a dataset
+index_workers = max((os.cpu_count() or 2) // 2, 1)
+# Logs handed to a worker at once, the index is refreshed after each batch
+index_chunk_size = 256
+
+
+# Prompt status of a point that is deliberately left without coordinates, e.g. an instrument that left the view.
+# Tissue prompts keep a list of statuses, instrument prompts a single one
+out_of_view_status = 'Out of view'
+
+
+def is_out_of_view(prompt):
+    status = prompt.get('status') if isinstance(prompt, dict) else None
+    return status == out_of_view_status or (isinstance(status, list) and out_of_view_status in status)
+
+
+# Count the empty points and prompts of one keyframe. A prompt is empty when it is missing or None, a point is
+# missing when it is None and its prompt does not mark it out of view
+def count_keyframe(points, prompts):
+    missing_points = sum(1 for i, point in enumerate(points)
+                         if point is None and not (i < len(prompts) and is_out_of_view(prompts[i])))
+    empty_prompts = sum(1 for i in range(len(points)) if i >= len(prompts) or prompts[i] is None)
+    return missing_points, empty_prompts
+
+
+# Summary of the annotations of one video: (keyframes, fully labeled keyframes, missing points, empty prompts)
+def summarize_annotations(annotation_list, annotation_prompt):
+    labeled = 0
+    missing_points = 0
+    empty_prompts = 0
+    for key, points in annotation_list.items():
+        missing, empty = count_keyframe(points, (annotation_prompt or {}).get(key) or [])
+        labeled += missing == 0 and empty == 0
+        missing_points += missing
+        empty_prompts += empty
+    return len(annotation_list), labeled, missing_points, empty_prompts
+
+
+# Summary of the annotation log of a video, None if there is no readable log. Old-version logs have no prompts
+def summarize_log(log_path):
+    log_data = load_log_data(log_path)
+    if not isinstance(log_data, dict):
+        return None
+    try:
+        if 'history' in log_data:
+            return summarize_annotations(log_data['history'], None)
+        if 'Tracking_Annotation' not in log_data:
+            return None
+        return summarize_annotations(log_data['Tracking_Annotation'], log_data.get('Text_Annotation'))
+    except (AttributeError, TypeError):
+        return None
+
+
+# Summary of a video without a log: every keyframe has one empty point. The keyframes are counted from the probed
+# length, a video that was not probed yet has none
+def summarize_missing(meta):
+    keyframes = 0 if meta is None else len(get_keyframes_list(meta['length']))
+    return keyframes, 0, keyframes, keyframes
+
+
+# First keyframe after a frame that is not fully labeled, None if there is none
+def find_incomplete_keyframe(annotation_list, annotation_prompt, after=-1):
+    for keyframe in sorted(int(key) for key in annotation_list):
+        if keyframe <= after:
+            continue
+        key = str(keyframe)
+        if count_keyframe(annotation_list[key], (annotation_prompt or {}).get(key) or []) != (0, 0):
+            return keyframe
+    return None
+
+
+# Annotation summaries of every video of a dataset, by global index, as one array of
+# (keyframes, labeled keyframes, missing points, empty prompts) rows
+class AnnotationIndex:
+    def __init__(self, length=0):
+        self.table = np.zeros((length, 4), dtype=np.int32)
+        self.ready = np.zeros(length, dtype=bool)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ready)
+
+    # Make room for the videos of an added dataset root
+    def extend(self, length):
+        with self.lock:
+            if length <= len(self.ready):
+                return
+            self.table = np.concatenate([self.table, np.zeros((length - len(self.ready), 4), dtype=np.int32)])
+            self.ready = np.concatenate([self.ready, np.zeros(length - len(self.ready), dtype=bool)])
+
+    # Store the summary of a video. Summaries read from the logs do not replace one stored since, after a save
+    def set(self, index, summary, replace=True):
+        with self.lock:
+            if not replace and self.ready[index]:
+                return
+            self.table[index] = summary
+            self.ready[index] = True
+
+    def get(self, index):
+        with self.lock:
+            return tuple(int(v) for v in self.table[index]) if self.ready[index] else None
+
+    # Videos that still need work, videos not summarized yet are counted in
+    def get_incomplete(self):
+        with self.lock:
+            return ~self.ready | (self.table[:, 0] == 0) | (self.table[:, 1] < self.table[:, 0])
+
+    # Share of fully labeled keyframes of each video, NaN for videos not summarized yet
+    def get_completion(self):
+        with self.lock:
+            completion = self.table[:, 1] / np.maximum(self.table[:, 0], 1)
+            completion[~self.ready] = np.nan
+            return completion
+
+    # First incomplete video after an index, wrapping around to the index itself. None if every video is done
+    def next_incomplete(self, index):
+        incomplete = np.roll(self.get_incomplete(), -(index + 1))
+        offsets = np.flatnonzero(incomplete)
+        if not len(offsets):
+            return None
+        return (index + 1 + int(offsets[0])) % len(self)
+
+
+# Background builder of annotation indexes from the logs, the logs are parsed by a process pool and no video
+# is opened
+class AnnotationIndexer(QThread):
+    IndexUpdated = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.queue = []
+
+    # Queue the videos [start, stop) of a dataset, their summaries go to the given index
+    def request(self, annotation_index, dataset, start, stop):
+        with self.condition:
+            self.queue.append((annotation_index, dataset, start, stop))
+            self.condition.notify()
+        if not self.isRunning():
+            self.start()
+
+    # Drop the queued datasets, e.g. when another dataset is loaded
+    def clear(self):
+        with self.condition:
+            self.queue.clear()
+
+    def stop(self):
+        with self.condition:
+            self.stop_event.set()
+            self.queue.clear()
+            self.condition.notify()
+        self.wait()
+        self.stop_event.clear()
+
+    def run(self):
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=index_workers, mp_context=context) as pool:
+            while True:
+                with self.condition:
+                    while not self.queue and not self.stop_event.is_set():
+                        self.condition.wait()
+                    if self.stop_event.is_set():
+                        break
+                    annotation_index, dataset, start, stop = self.queue.pop(0)
+                self.build(pool, annotation_index, dataset, start, stop)
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def build(self, pool, annotation_index, dataset, start, stop):
+        sample_list = [dataset[index] for index in range(start, stop)]
+        try:
+            results = pool.map(summarize_log, [sample['log_path'] for sample in sample_list],
+                               chunksize=index_chunk_size)
+            for index, (sample, summary) in enumerate(zip(sample_list, results), start):
+                if self.stop_event.is_set():
+                    return
+                if summary is None:
+                    summary = summarize_missing(sample['meta'])
+                annotation_index.set(index, summary, replace=False)
+                if (index - start + 1) % index_chunk_size == 0:
+                    self.IndexUpdated.emit()
+        except BrokenProcessPool:
+            return
+        self.IndexUpdated.emit()
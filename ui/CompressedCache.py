@@ -0,0 +1,157 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# Memory budget of the compressed frame cache (MB), holds about ten times the frames of the raw cache
+compressed_cache_size = 256
+# Codec of the cached frames: '.jpg' (fast, near lossless at this quality) or '.png' (lossless, larger)
+compressed_cache_codec = '.jpg'
+compressed_cache_quality = 95
+# Threads compressing and decompressing frames, OpenCV releases the GIL while coding
+compressed_cache_workers = 2
+# Frames decompressed ahead of a sequential hit
+compressed_prefetch_size = 8
+
+
+def get_codec_params(codec):
+    if codec == '.png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, 1]
+    return [cv2.IMWRITE_JPEG_QUALITY, compressed_cache_quality]
+
+
+def encode_frame(frame, codec):
+    s, buffer = cv2.imencode(codec, frame, get_codec_params(codec))
+    return buffer if s else None
+
+
+def decode_frame(buffer):
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+# Second cache tier below FrameCache: display frames kept as encoded bytes in LRU order under a memory budget.
+# Frames are compressed in the background, so put() never blocks the GUI thread. A hit is decompressed by the
+# worker pool together with the next frames, which are ready by the time sequential playback asks for them
+class CompressedFrameCache:
+    def __init__(self, cache_size=compressed_cache_size, codec=compressed_cache_codec):
+        self.budget = int(cache_size * 1024 * 1024)
+        self.codec = codec
+        self.buffers = OrderedDict()
+        self.size = 0
+        self.raw_size = 0
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=compressed_cache_workers)
+        # Frames being compressed, and decompressions running ahead of the playhead
+        self.encoding = set()
+        self.decoding = {}
+        # Prefetching only starts once frames are read one after the other
+        self.last_key = None
+        # Increased by clear(), compressions of an older generation are thrown away
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.decode_count = 0
+        self.decode_time = 0.0
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.buffers
+
+    def _decode(self, buffer):
+        start = time.perf_counter()
+        frame = decode_frame(buffer)
+        with self.lock:
+            self.decode_count += 1
+            self.decode_time += time.perf_counter() - start
+        return frame
+
+    def _submit_decode(self, key):
+        future = self.decoding.get(key)
+        if future is None:
+            buffer = self.buffers.get(key)
+            if buffer is None:
+                return None
+            future = self.decoding[key] = self.pool.submit(self._decode, buffer)
+        return future
+
+    # Get a decompressed frame, during sequential reads the following ones are decompressed ahead.
+    # None if the frame is not cached
+    def get(self, key):
+        with self.lock:
+            future = self._submit_decode(key)
+            if future is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.buffers.move_to_end(key)
+            if self.last_key == key - 1:
+                for next_key in range(key + 1, key + compressed_prefetch_size + 1):
+                    if next_key not in self.buffers:
+                        break
+                    self._submit_decode(next_key)
+            self.last_key = key
+        frame = future.result()
+        with self.lock:
+            self.decoding.pop(key, None)
+            # Prefetched frames the playhead went away from
+            for stale_key in [k for k in self.decoding if not key < k <= key + compressed_prefetch_size]:
+                self.decoding.pop(stale_key).cancel()
+        return frame
+
+    # Compress a frame in the background
+    def put(self, key, frame):
+        with self.lock:
+            if key in self.buffers or key in self.encoding:
+                return
+            self.encoding.add(key)
+            generation = self.generation
+        self.pool.submit(self._encode, key, frame, generation)
+
+    def _encode(self, key, frame, generation):
+        buffer = encode_frame(frame, self.codec)
+        with self.lock:
+            self.encoding.discard(key)
+            if buffer is None or generation != self.generation or buffer.nbytes > self.budget:
+                return
+            self.buffers[key] = buffer
+            self.size += buffer.nbytes
+            self.raw_size += frame.nbytes
+            self._evict(frame.nbytes)
+
+    def _evict(self, frame_bytes):
+        while self.size > self.budget:
+            _, old_buffer = self.buffers.popitem(last=False)
+            self.size -= old_buffer.nbytes
+            self.raw_size -= frame_bytes
+
+    def set_budget(self, cache_size):
+        with self.lock:
+            self.budget = int(cache_size * 1024 * 1024)
+            frame_bytes = self.raw_size // max(len(self.buffers), 1)
+            self._evict(frame_bytes)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.buffers.clear()
+            for future in self.decoding.values():
+                future.cancel()
+            self.decoding.clear()
+            self.size = 0
+            self.raw_size = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'frames': len(self.buffers),
+                    'size_mb': self.size / 1024 / 1024, 'budget_mb': self.budget / 1024 / 1024,
+                    'ratio': self.raw_size / self.size if self.size else 0.0,
+                    'decode_ms': 1000 * self.decode_time / self.decode_count if self.decode_count else 0.0}
+
+    def release(self):
+        self.clear()
+        self.pool.shutdown(wait=True, cancel_futures=True)
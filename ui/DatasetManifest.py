@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+import threading
+
+from ui.FrameSource import image_extensions, natural_key, video_extensions
+
+# Bumped whenever the layout of the manifest changes, older manifests are rebuilt
+manifest_version = 1
+# Serializes read-modify-write cycles of manifests, the prober updates them in the background
+manifest_lock = threading.RLock()
+
+
+# Path of the manifest of a dataset root, stored with the logs since the classification folder may be read-only
+def get_manifest_path(data_path):
+    return os.path.join(data_path, 'log', '.manifest.json')
+
+
+# Stable id of a sample, from its class and name, so it survives rescans and reordering
+def get_sample_id(sample_class, sample_name):
+    return hashlib.sha1('{}/{}'.format(sample_class, sample_name).encode('utf-8')).hexdigest()[:16]
+
+
+# Name of a sample without its video extension, a frame folder is named as it is
+def get_sample_stem(sample_name):
+    stem, extension = os.path.splitext(sample_name)
+    return stem if extension.lower() in video_extensions else sample_name
+
+
+def is_image_folder(folder_path):
+    with os.scandir(folder_path) as entries:
+        return any(entry.name.lower().endswith(image_extensions) for entry in entries)
+
+
+# List the samples of a class folder in natural name order. Samples whose size and modification time did not
+# change keep their entry, including the metadata probed for them
+def scan_class(class_path, sample_class, old_samples):
+    samples = {}
+    with os.scandir(class_path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                stat = entry.stat()
+            except OSError:
+                continue
+            old_sample = old_samples.get(entry.name)
+            if old_sample is not None and old_sample['size'] == stat.st_size and \
+                    old_sample['mtime'] == stat.st_mtime and old_sample['dir'] == is_dir:
+                samples[entry.name] = old_sample
+                continue
+            if is_dir:
+                try:
+                    if not is_image_folder(entry.path):
+                        continue
+                except OSError:
+                    continue
+            elif os.path.splitext(entry.name)[1].lower() not in video_extensions:
+                continue
+            samples[entry.name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'dir': is_dir,
+                                   'id': get_sample_id(sample_class, entry.name)}
+            # A rewritten video keeps its annotations
+            if old_sample is not None and 'log' in old_sample:
+                samples[entry.name]['log'] = old_sample['log']
+    return {name: samples[name] for name in sorted(samples, key=natural_key)}
+
+
+# Give the samples of a class without one their log file name, False if they all had one. A sample is logged
+# under its name without the video extension, or under its full name (a.avi.json) when another sample of the class
+# already has that log, and a frame folder then under its id too. Names are kept in the manifest, so a sample added
+# later never takes the log of another
+def assign_log_names(log_folder, samples):
+    new_names = [name for name, sample in samples.items() if 'log' not in sample]
+    if not new_names:
+        return False
+    taken = {sample['log'] for sample in samples.values() if 'log' in sample}
+
+    # Logs already written under the full name stay with their sample. Then .mp4 videos come first for the short
+    # name, they were the only videos supported before other formats and frame folders, and folders come last
+    full_logs = {name for name in new_names
+                 if get_sample_stem(name) != name and os.path.exists(os.path.join(log_folder, name + '.json'))}
+    for name in sorted(new_names, key=lambda name: (name not in full_logs, not name.lower().endswith('.mp4'),
+                                                    samples[name]['dir'])):
+        log_name = get_sample_stem(name) + '.json'
+        if name in full_logs or log_name in taken:
+            log_name = name + '.json'
+        if log_name in taken:
+            log_name = '{}.{}.json'.format(name, samples[name]['id'])
+        samples[name]['log'] = log_name
+        taken.add(log_name)
+    return True
+
+
+def read_manifest(data_path):
+    try:
+        with open(get_manifest_path(data_path), 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != manifest_version:
+        return {}
+    return manifest
+
+
+# Written under a temporary name, so a reader never sees a partial manifest
+def save_manifest(data_path, manifest):
+    manifest_path = get_manifest_path(data_path)
+    temp_path = manifest_path + '.part'
+    try:
+        with open(temp_path, 'w') as f:
+            f.write(json.dumps(manifest))
+        os.replace(temp_path, manifest_path)
+    except OSError:
+        pass
+
+
+# Load the manifest of a dataset root: {'version', 'classes': {class: {'mtime', 'samples': {name: entry}}}}.
+# Only class folders whose modification time changed since the last scan are listed again. Classes and samples
+# are kept in natural name order, so the indices of a dataset do not depend on the file system
+def load_manifest(data_path):
+    with manifest_lock:
+        return scan_manifest(data_path)
+
+
+def scan_manifest(data_path):
+    manifest = read_manifest(data_path)
+    old_classes = manifest.get('classes', {})
+    classes = {}
+    changed = False
+    with os.scandir(os.path.join(data_path, 'classification')) as entries:
+        for entry in entries:
+            try:
+                if not entry.is_dir():
+                    continue
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            old_class = old_classes.get(entry.name)
+            if old_class is not None and old_class['mtime'] == mtime:
+                classes[entry.name] = old_class
+                continue
+            classes[entry.name] = {'mtime': mtime,
+                                   'samples': scan_class(entry.path, entry.name,
+                                                         {} if old_class is None else old_class['samples'])}
+            changed = True
+    classes = {name: classes[name] for name in sorted(classes, key=natural_key)}
+    for name, class_entry in classes.items():
+        if assign_log_names(os.path.join(data_path, 'log', name), class_entry['samples']):
+            changed = True
+    manifest = {'version': manifest_version, 'classes': classes}
+    if changed or list(classes) != list(old_classes):
+        save_manifest(data_path, manifest)
+    return manifest
+
+
+# Store probed metadata, keyed by (class, sample name), in the entries of a dataset root
+def update_manifest_meta(data_path, meta_dict):
+    with manifest_lock:
+        manifest = scan_manifest(data_path)
+        for (sample_class, sample_name), meta in meta_dict.items():
+            sample = manifest['classes'].get(sample_class, {}).get('samples', {}).get(sample_name)
+            if sample is not None:
+                sample['meta'] = meta
+        save_manifest(data_path, manifest)
@@ -0,0 +1,120 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from ui.FrameSource import open_frame_source
+from ui.VideoMeta import load_gop_index
+from ui.DatasetManifest import update_manifest_meta
+from ui.VideoPoster import save_poster
+
+# Processes probing videos in parallel
+probe_workers = max((os.cpu_count() or 2) // 2, 1)
+# Probed metadata is written into the manifest after this many videos, and when the dataset is done
+manifest_flush_size = 64
+
+
+# Get the codec of a video as its FourCC, frame folders have none
+def get_codec(video_path):
+    if os.path.isdir(video_path):
+        return 'image'
+    video = cv2.VideoCapture(video_path)
+    fourcc = int(video.get(cv2.CAP_PROP_FOURCC))
+    video.release()
+    return ''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip('\x00').strip()
+
+
+# Probe one video in a worker process: fps, size and verified length (also cached in the sidecar), codec and the
+# number of I-frames from the GOP index. The middle frame is saved as the poster of the video
+def probe_sample(video_path, log_path):
+    source = open_frame_source(video_path)
+    try:
+        meta = dict(source.probe(log_path))
+        frame = source.read(meta['length'] // 2) if meta['length'] else None
+        if frame is not None:
+            save_poster(video_path, frame)
+    finally:
+        source.release()
+    meta['codec'] = get_codec(video_path)
+    meta['keyframes'] = len(load_gop_index(video_path, log_path)['keyframes'])
+    return meta
+
+
+# Background prober of the videos of whole datasets. Videos whose manifest entry has no metadata yet are probed by
+# a process pool, so captures are never opened on the GUI thread
+class DatasetProber(QThread):
+    MetaProbed = pyqtSignal(str, dict)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.queue = []
+        # Videos that could not be probed, they are not tried again in this session
+        self.failed = set()
+
+    # Queue DatasetLoaders, their samples without metadata are probed in dataset order
+    def request(self, data_loader):
+        with self.condition:
+            self.queue.append(data_loader)
+            self.condition.notify()
+        if not self.isRunning():
+            self.start()
+
+    def stop(self):
+        with self.condition:
+            self.stop_event.set()
+            self.queue.clear()
+            self.condition.notify()
+        self.wait()
+        self.stop_event.clear()
+
+    def run(self):
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=probe_workers, mp_context=context) as pool:
+            while True:
+                with self.condition:
+                    while not self.queue and not self.stop_event.is_set():
+                        self.condition.wait()
+                    if self.stop_event.is_set():
+                        break
+                    data_loader = self.queue.pop(0)
+                self.probe_dataset(pool, data_loader)
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def probe_dataset(self, pool, data_loader):
+        futures = {}
+        for sample in data_loader:
+            if sample.get('meta') is None and sample['sample_path'] not in self.failed:
+                futures[pool.submit(probe_sample, sample['sample_path'], sample['log_path'])] = sample
+        # Results are grouped by dataset root, each root has its own manifest
+        pending = {}
+        for count, future in enumerate(as_completed(futures), 1):
+            if self.stop_event.is_set():
+                for other in futures:
+                    other.cancel()
+                break
+            sample = futures[future]
+            try:
+                meta = future.result()
+            except BrokenProcessPool:
+                break
+            # Unreadable or corrupt videos, e.g. cv2.error or a ValueError from broken metadata
+            except Exception:
+                self.failed.add(sample['sample_path'])
+                continue
+            pending.setdefault(sample['data_path'], {})[(sample['sample_class'], sample['sample_name'])] = meta
+            self.MetaProbed.emit(sample['sample_path'], meta)
+            if count % manifest_flush_size == 0:
+                self.flush(pending)
+        self.flush(pending)
+
+    @staticmethod
+    def flush(pending):
+        for data_path, meta_dict in pending.items():
+            update_manifest_meta(data_path, meta_dict)
+        pending.clear()
@@ -0,0 +1,170 @@
+import os
+import glob
+import hashlib
+import threading
+
+import cv2
+import numpy as np
+
+from ui.FrameSource import open_frame_source
+from ui.VideoMeta import VideoOpenError, get_file_stamp
+
+# Folder of the on-disk frame caches
+disk_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'EVA', 'frames')
+# Size cap of all on-disk frame caches together (MB), whole videos are evicted in LRU order
+disk_cache_size = 8192
+
+# Keys of the caches opened by this process, they are never evicted
+open_keys = set()
+open_keys_lock = threading.Lock()
+
+
+# Cache key of a video at a display size, from the video path, size and modification time,
+# and the active region when the frames are cropped to it
+def get_cache_key(video_path, scaling_size, active_region=None):
+    stamp = get_file_stamp(video_path)
+    key = '{}|{}|{}|{}x{}'.format(os.path.abspath(video_path), stamp['size'], stamp['mtime'],
+                                  scaling_size[0], scaling_size[1])
+    if active_region is not None:
+        key += '|{},{},{},{}'.format(*active_region)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+# Delete the least recently used caches until there is room for a new one. The modification time of
+# the flag file is the last use, it is touched whenever a cache is opened
+def make_room(needed_size):
+    entry_list = []
+    total_size = 0
+    for flags_path in glob.glob(os.path.join(disk_cache_dir, '*.flags.npy')):
+        frames_path = flags_path[:-len('.flags.npy')] + '.npy'
+        try:
+            size = os.path.getsize(frames_path) + os.path.getsize(flags_path)
+            last_used = os.path.getmtime(flags_path)
+        except OSError:
+            continue
+        entry_list.append((last_used, os.path.basename(frames_path)[:-len('.npy')], frames_path, flags_path, size))
+        total_size += size
+    budget = disk_cache_size * 1024 * 1024
+    for _, key, frames_path, flags_path, size in sorted(entry_list):
+        if total_size + needed_size <= budget:
+            break
+        with open_keys_lock:
+            if key in open_keys:
+                continue
+        try:
+            os.remove(frames_path)
+            os.remove(flags_path)
+        except OSError:
+            continue
+        total_size -= size
+    return total_size + needed_size <= budget
+
+
+# Display-resolution frames of one video in a raw uint8 .npy file, memory-mapped so a cached frame costs no
+# decoding and no copy. A flag per frame marks the frames that were written
+class DiskFrameCache:
+    def __init__(self, key, frames, flags):
+        self.key = key
+        self.frames = frames
+        self.flags = flags
+        self.hits = 0
+
+    def __contains__(self, index):
+        return 0 <= index < len(self.flags) and self.flags[index] != 0
+
+    # Get a read-only view of a cached frame, None if it is not cached yet
+    def get(self, index):
+        if index not in self:
+            return None
+        self.hits += 1
+        return self.frames[index]
+
+    def put(self, index, frame):
+        if index in self or frame.shape != self.frames.shape[1:]:
+            return
+        self.frames[index] = frame
+        self.flags[index] = 1
+
+    def is_complete(self):
+        return bool(self.flags.all())
+
+    def get_stats(self):
+        return {'hits': self.hits, 'cached': int(np.count_nonzero(self.flags)), 'frames': len(self.flags)}
+
+    def release(self):
+        self.frames.flush()
+        self.flags.flush()
+        self.frames = self.flags = None
+        with open_keys_lock:
+            open_keys.discard(self.key)
+
+
+# Open or create the disk cache of a video, None if it does not fit into the size cap. A video larger than
+# the whole cap is refused before anything is evicted for it
+def open_disk_cache(video_path, video_len, scaling_size, active_region=None):
+    shape = (video_len, scaling_size[0], scaling_size[1], 3)
+    if int(np.prod(shape)) + video_len > disk_cache_size * 1024 * 1024:
+        return None
+    try:
+        key = get_cache_key(video_path, scaling_size, active_region)
+    except OSError:
+        return None
+    frames_path = os.path.join(disk_cache_dir, key + '.npy')
+    flags_path = os.path.join(disk_cache_dir, key + '.flags.npy')
+    with open_keys_lock:
+        open_keys.add(key)
+    try:
+        if os.path.exists(frames_path) and os.path.exists(flags_path):
+            frames = np.load(frames_path, mmap_mode='r+')
+            flags = np.load(flags_path, mmap_mode='r+')
+            if frames.shape == shape and flags.shape == (video_len,):
+                os.utime(flags_path)
+                return DiskFrameCache(key, frames, flags)
+            del frames, flags
+        os.makedirs(disk_cache_dir, exist_ok=True)
+        if not make_room(int(np.prod(shape)) + video_len):
+            raise OSError('Disk cache is full')
+        # The flags are created last, a cache without them is incomplete and rebuilt
+        frames = np.lib.format.open_memmap(frames_path, mode='w+', dtype=np.uint8, shape=shape)
+        flags = np.lib.format.open_memmap(flags_path, mode='w+', dtype=np.uint8, shape=(video_len,))
+        return DiskFrameCache(key, frames, flags)
+    except (OSError, ValueError):
+        with open_keys_lock:
+            open_keys.discard(key)
+        return None
+
+
+# Background thread writing every frame of a video into its disk cache with one sequential pass
+class DiskCacheFiller(threading.Thread):
+    def __init__(self, disk_cache, video_path, video_len, crop=None):
+        super().__init__(daemon=True)
+        self.disk_cache = disk_cache
+        self.video_path = video_path
+        self.video_len = video_len
+        # Cuts the active region out of a source frame
+        self.crop = crop
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def run(self):
+        disk_cache = self.disk_cache
+        if disk_cache.is_complete():
+            return
+        try:
+            source = open_frame_source(self.video_path)
+        except VideoOpenError:
+            return
+        height, width = disk_cache.frames.shape[1:3]
+        try:
+            for index, frame in source.read_range(0, self.video_len):
+                if self.stop_event.is_set():
+                    break
+                if index not in disk_cache:
+                    if self.crop is not None:
+                        frame = self.crop(frame)
+                    disk_cache.put(index, cv2.resize(frame, (width, height)))
+        finally:
+            source.release()
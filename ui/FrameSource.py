@@ -0,0 +1,328 @@
+import os
+import re
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from ui.VideoMeta import VideoOpenError, probe_video
+
+try:
+    import av
+except ImportError:
+    av = None
+
+# Decoder used for video files: 'opencv' or 'pyav' (falls back to OpenCV when PyAV is not installed)
+frame_source_backend = 'opencv'
+# Forward gaps up to this many frames are skipped by decoding instead of a seek
+max_grab_gap = 16
+# File types opened as videos
+video_extensions = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.wmv', '.mpg', '.mpeg', '.webm')
+# File types read as frames of an image folder, and the frame rate assumed for them
+image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+image_folder_fps = 25
+# Threads decoding the images of read_range
+image_read_workers = 4
+
+
+# Random access reader over a capture. It tracks the decoder position so sequential reads
+# never seek, and seeks land on the preceding I-frame when the GOP index is known
+class FrameReader:
+    def __init__(self, video):
+        self.video = video
+        # Index of the frame the next read() returns
+        self.position = None
+        self.gop_keyframes = None
+        self.read_count = 0
+        self.grab_count = 0
+        self.seek_count = 0
+
+    def set_gop_keyframes(self, gop_keyframes):
+        self.gop_keyframes = gop_keyframes or None
+
+    # Get the I-frame that starts the GOP of a frame
+    def get_gop_start(self, index):
+        gop_keyframes = self.gop_keyframes
+        if gop_keyframes is None:
+            return None
+        return gop_keyframes[max(bisect.bisect_right(gop_keyframes, index) - 1, 0)]
+
+    # Whether a frame is reached faster by decoding forward from the current position than by a seek
+    def is_sequential(self, index):
+        position = self.position
+        if position is None or position > index:
+            return False
+        gop_start = self.get_gop_start(index)
+        return index - position <= max_grab_gap or (gop_start is not None and position >= gop_start)
+
+    def get_stats(self):
+        return {'read': self.read_count, 'grab': self.grab_count, 'seek': self.seek_count}
+
+    # Read a frame, None is returned if it cannot be decoded
+    def read(self, index):
+        if self.is_sequential(index):
+            grab_num = index - self.position
+        else:
+            gop_start = self.get_gop_start(index)
+            seek_index = index if gop_start is None else gop_start
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, seek_index)
+            self.seek_count += 1
+            grab_num = index - seek_index
+        for _ in range(grab_num):
+            self.video.grab()
+            self.grab_count += 1
+        s, frame = self.video.read()
+        self.read_count += 1
+        self.position = index + 1 if s else None
+        return frame if s else None
+
+
+# Frame source interface used by VideoManager and the decoders: metadata, random access read(index)
+# and sequential read_range(start, stop). Frames are BGR arrays, None when they cannot be read
+class FrameSource:
+    def __init__(self, path):
+        self.path = path
+        self.fps = 0.0
+        self.height = 0
+        self.width = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def isOpened(self):
+        return self.length > 0
+
+    # Get fps, size and length, the length of video files is verified and cached in the sidecar
+    def probe(self, log_path=None):
+        return {'fps': self.fps, 'height': self.height, 'width': self.width, 'length': self.length}
+
+    def read(self, index):
+        raise NotImplementedError
+
+    # Read consecutive frames, stops at the first frame that cannot be read
+    def read_range(self, start, stop):
+        for index in range(start, stop):
+            frame = self.read(index)
+            if frame is None:
+                return
+            yield index, frame
+
+    # Read a sorted list of frames front to back, frames in between are decoded but not returned
+    def read_indices(self, index_list):
+        if not index_list:
+            return
+        wanted = set(index_list)
+        for index, frame in self.read_range(index_list[0], index_list[-1] + 1):
+            if index in wanted:
+                yield index, frame
+
+    def set_gop_keyframes(self, gop_keyframes):
+        pass
+
+    def get_stats(self):
+        return {}
+
+    def release(self):
+        pass
+
+
+# Video file decoded by cv2.VideoCapture
+class OpenCVSource(FrameSource):
+    def __init__(self, path):
+        super().__init__(path)
+        self.video = cv2.VideoCapture(path)
+        self.reader = FrameReader(self.video)
+        self.fps = self.video.get(cv2.CAP_PROP_FPS)
+        self.height = int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.width = int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.length = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def isOpened(self):
+        return self.video.isOpened()
+
+    def probe(self, log_path=None):
+        meta = probe_video(self.path, log_path, video=self.video)
+        self.length = meta['length']
+        return meta
+
+    def read(self, index):
+        return self.reader.read(index)
+
+    # Frames in between are only grabbed, which skips their color conversion
+    def read_indices(self, index_list):
+        reader = self.reader
+        for index in index_list:
+            if reader.position is not None and reader.position <= index:
+                for _ in range(index - reader.position):
+                    self.video.grab()
+                    reader.grab_count += 1
+                reader.position = index
+            frame = reader.read(index)
+            if frame is None:
+                return
+            yield index, frame
+
+    def set_gop_keyframes(self, gop_keyframes):
+        self.reader.set_gop_keyframes(gop_keyframes)
+
+    def get_stats(self):
+        return self.reader.get_stats()
+
+    def release(self):
+        self.video.release()
+
+
+# Video file decoded by PyAV with frame and slice threading. Seeks go to the preceding key frame
+# and frames are matched by their timestamp, so this assumes a constant frame rate
+class PyAVSource(FrameSource):
+    def __init__(self, path):
+        super().__init__(path)
+        self.container = av.open(path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.fps = float(self.stream.average_rate or self.stream.guessed_rate or image_folder_fps)
+        self.height = self.stream.codec_context.height
+        self.width = self.stream.codec_context.width
+        self.length = self.stream.frames
+        self.start_time = self.stream.start_time or 0
+        # Decoding position and the same seek policy as FrameReader
+        self.reader = FrameReader(None)
+        self.frames = None
+
+    def isOpened(self):
+        return self.container is not None
+
+    # The length is probed by OpenCV, so that both backends agree on it
+    def probe(self, log_path=None):
+        meta = probe_video(self.path, log_path)
+        self.length = meta['length']
+        return meta
+
+    def _get_index(self, frame, default):
+        if frame.pts is None:
+            return default
+        return int(round(float((frame.pts - self.start_time) * self.stream.time_base) * self.fps))
+
+    def read(self, index):
+        reader = self.reader
+        try:
+            if not reader.is_sequential(index):
+                gop_start = reader.get_gop_start(index)
+                seek_index = index if gop_start is None else gop_start
+                pts = self.start_time + int(seek_index / self.fps / self.stream.time_base)
+                self.container.seek(pts, stream=self.stream, backward=True, any_frame=False)
+                self.frames = self.container.decode(self.stream)
+                reader.position = None
+                reader.seek_count += 1
+            for frame in self.frames:
+                frame_index = self._get_index(frame, reader.position if reader.position is not None else index)
+                if frame_index < index:
+                    reader.position = frame_index + 1
+                    reader.grab_count += 1
+                    continue
+                reader.position = frame_index + 1
+                reader.read_count += 1
+                return frame.to_ndarray(format='bgr24')
+        except av.error.FFmpegError:
+            pass
+        reader.position = None
+        return None
+
+    def set_gop_keyframes(self, gop_keyframes):
+        self.reader.set_gop_keyframes(gop_keyframes)
+
+    def get_stats(self):
+        return self.reader.get_stats()
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+
+# Sort key that puts frame_2 before frame_10
+def natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+# Folder of JPEG/PNG frames in natural file name order. Only the file list is read when it is opened,
+# each image is memory-mapped and decoded when it is read
+class ImageFolderSource(FrameSource):
+    def __init__(self, path):
+        super().__init__(path)
+        name_list = sorted((name for name in os.listdir(path) if name.lower().endswith(image_extensions)),
+                           key=natural_key)
+        self.file_list = [os.path.join(path, name) for name in name_list]
+        self.fps = image_folder_fps
+        self.read_count = 0
+        self.length = len(self.file_list)
+        first_frame = self.read(0)
+        if first_frame is None:
+            self.length = 0
+        else:
+            self.height, self.width = first_frame.shape[:2]
+
+    def read(self, index):
+        if not 0 <= index < self.length:
+            return None
+        try:
+            buffer = np.memmap(self.file_list[index], dtype=np.uint8, mode='r')
+        except (OSError, ValueError):
+            return None
+        frame = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        del buffer
+        self.read_count += 1
+        if frame is not None and self.height and frame.shape[:2] != (self.height, self.width):
+            frame = cv2.resize(frame, (self.width, self.height))
+        return frame
+
+    # Images are independent, so they are decoded by a thread pool
+    def read_range(self, start, stop):
+        stop = min(stop, self.length)
+        with ThreadPoolExecutor(max_workers=image_read_workers) as pool:
+            for chunk_start in range(start, stop, 4 * image_read_workers):
+                index_list = range(chunk_start, min(chunk_start + 4 * image_read_workers, stop))
+                for index, frame in zip(index_list, pool.map(self.read, index_list)):
+                    if frame is None:
+                        return
+                    yield index, frame
+
+    # Images are independent, so skipped frames cost nothing
+    def read_indices(self, index_list):
+        for index in index_list:
+            frame = self.read(index)
+            if frame is None:
+                return
+            yield index, frame
+
+    def get_stats(self):
+        return {'read': self.read_count}
+
+
+# Whether a path can be opened as a frame source: a video file or a folder of images
+def is_frame_source(path):
+    if os.path.isdir(path):
+        return any(name.lower().endswith(image_extensions) for name in os.listdir(path))
+    return os.path.splitext(path)[1].lower() in video_extensions
+
+
+# Open a video file or an image folder with the configured backend
+def open_frame_source(path, backend=None):
+    if not os.path.exists(path):
+        raise VideoOpenError('Video not found: {}'.format(path))
+    backend = backend or frame_source_backend
+    if os.path.isdir(path):
+        source = ImageFolderSource(path)
+    elif backend == 'pyav' and av is not None:
+        try:
+            source = PyAVSource(path)
+        except (av.error.FFmpegError, IndexError):
+            raise VideoOpenError('Cannot open video: {}'.format(path))
+    else:
+        source = OpenCVSource(path)
+    if not source.isOpened():
+        source.release()
+        raise VideoOpenError('Cannot open video: {}'.format(path))
+    return source
@@ -0,0 +1,186 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from ui.DiskCache import get_cache_key
+from ui.FrameSource import open_frame_source
+from ui.VideoDecoder import preview_scale
+from ui.VideoMeta import VideoOpenError
+
+# Folder of the keyframe stores
+keyframe_store_dir = os.path.join(os.path.expanduser('~'), '.cache', 'EVA', 'keyframes')
+# JPEG quality of the display-size keyframes
+keyframe_store_quality = 95
+# Scrubbing previews are decoded from the keyframes at a reduced size, the last ones are kept decoded
+thumbnail_flags = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+thumbnail_cache_size = 64
+
+
+# Display-size keyframes (JPEG encoded) of one video, their scrubbing previews are decoded from them. Saved as one
+# .npz file: the encoded frames are concatenated into a single byte array, so loading needs no pickling
+class KeyframeStore:
+    def __init__(self, path):
+        self.path = path
+        self.frames = {}
+        self.thumbnails = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, index):
+        return index in self.frames
+
+    def get_frame(self, index):
+        buffer = self.frames.get(index)
+        return None if buffer is None else cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+    # Preview of a keyframe, the JPEG is decoded straight at the preview size (see preview_scale)
+    def get_thumbnail(self, index):
+        with self.lock:
+            thumbnail = self.thumbnails.get(index)
+            if thumbnail is not None:
+                self.thumbnails.move_to_end(index)
+                return thumbnail
+            buffer = self.frames.get(index)
+        if buffer is None:
+            return None
+        thumbnail = cv2.imdecode(buffer, thumbnail_flags.get(preview_scale, cv2.IMREAD_REDUCED_COLOR_4))
+        if thumbnail is None:
+            return None
+        with self.lock:
+            self.thumbnails[index] = thumbnail
+            while len(self.thumbnails) > thumbnail_cache_size:
+                self.thumbnails.popitem(last=False)
+        return thumbnail
+
+    def put(self, index, frame):
+        s, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, keyframe_store_quality])
+        if not s:
+            return
+        with self.lock:
+            self.frames[index] = buffer
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                indices, offsets, buffers = data['indices'], data['offsets'], data['buffers']
+        except (OSError, ValueError, KeyError):
+            return
+        with self.lock:
+            for i, index in enumerate(indices.tolist()):
+                self.frames[index] = buffers[offsets[i]:offsets[i + 1]]
+
+    # Written under a temporary name, so an interrupted save never leaves a broken store
+    def save(self):
+        with self.lock:
+            indices = sorted(self.frames)
+            if not indices:
+                return
+            buffer_list = [self.frames[index] for index in indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([buffer.nbytes for buffer in buffer_list])
+        temp_path = self.path[:-len('.npz')] + '.part.npz'
+        try:
+            os.makedirs(keyframe_store_dir, exist_ok=True)
+            np.savez(temp_path, indices=np.array(indices, dtype=np.int64), offsets=offsets,
+                     buffers=np.concatenate(buffer_list))
+            os.replace(temp_path, self.path)
+        except OSError:
+            pass
+
+
+# Background writer of keyframe stores. A builder hands its store over when it ends, so a stop never waits for the
+# store to be written, and stores are written one at a time, so two saves of one store do not share a temporary file.
+# A store reopened before it is written is taken from here, it has more keyframes than its file
+class KeyframeStoreWriter(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # Stores waiting to be written and the number of their queued saves, by path
+        self.pending = {}
+
+    def save(self, store):
+        with self.lock:
+            count = self.pending[store.path][1] if store.path in self.pending else 0
+            self.pending[store.path] = (store, count + 1)
+            if not self.is_alive():
+                self.start()
+        self.queue.put(store)
+
+    def get_pending(self, path):
+        with self.lock:
+            return self.pending[path][0] if path in self.pending else None
+
+    def run(self):
+        while True:
+            store = self.queue.get()
+            store.save()
+            with self.lock:
+                pending_store, count = self.pending[store.path]
+                if count > 1:
+                    self.pending[store.path] = (pending_store, count - 1)
+                else:
+                    del self.pending[store.path]
+
+
+keyframe_store_writer = KeyframeStoreWriter()
+
+
+# Open the keyframe store of a video at a display size, with the keyframes saved by an earlier pass
+def open_keyframe_store(video_path, scaling_size, active_region=None):
+    try:
+        key = get_cache_key(video_path, scaling_size, active_region)
+    except OSError:
+        return None
+    path = os.path.join(keyframe_store_dir, key + '.npz')
+    store = keyframe_store_writer.get_pending(path)
+    if store is None:
+        store = KeyframeStore(path)
+        store.load()
+    return store
+
+
+# Background thread filling a keyframe store with one front-to-back pass, only the keyframes are converted.
+# A stopped pass saves what it has, in the background, and the next one resumes from there
+class KeyframeStoreBuilder(threading.Thread):
+    def __init__(self, store, video_path, keyframes_list, scaling_size, crop=None):
+        super().__init__(daemon=True)
+        self.store = store
+        self.video_path = video_path
+        self.keyframes_list = keyframes_list
+        self.scaling_size = scaling_size
+        # Cuts the active region out of a source frame
+        self.crop = crop
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def run(self):
+        index_list = [index for index in self.keyframes_list if index not in self.store]
+        if not index_list:
+            return
+        try:
+            source = open_frame_source(self.video_path)
+        except VideoOpenError:
+            return
+        height, width = self.scaling_size
+        count = len(self.store)
+        try:
+            for index, frame in source.read_indices(index_list):
+                if self.stop_event.is_set():
+                    break
+                if self.crop is not None:
+                    frame = self.crop(frame)
+                self.store.put(index, cv2.resize(frame, (width, height)))
+        finally:
+            source.release()
+        if len(self.store) > count:
+            keyframe_store_writer.save(self.store)
@@ -0,0 +1,235 @@
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+
+import cv2
+import numpy as np
+
+from ui.FrameSource import open_frame_source
+
+# Number of frame slots in the shared-memory ring
+ring_slots = 8
+# Seconds to wait for the decoder process before a read is given up
+read_timeout = 5.0
+# Answers of the decoder process kept for waiting threads, the oldest are dropped first. Far more than the
+# frames a ring can hold, so an answer is not dropped while its frame is still there
+announced_size = 16 * ring_slots
+
+
+# Map the shared-memory ring, frames are stored as (slot, height, width, 3) and every slot has a row
+# [frame index, sequence] in the table. The sequence is odd while the slot is being written
+def map_ring(frame_memory, table_memory, slot_num, frame_shape):
+    frames = np.ndarray((slot_num,) + tuple(frame_shape), dtype=np.uint8, buffer=frame_memory.buf)
+    table = np.ndarray((slot_num, 2), dtype=np.int64, buffer=table_memory.buf)
+    return frames, table
+
+
+# Decoder process main loop. Requests (tuples, never frames) arrive on the request queue:
+#   ('read', generation, index)                 decode a frame before anything else, drops the older read-ahead
+#   ('read_ahead', generation, index, count)    decode the following frames while idle
+#   ('cancel', generation)                      drop the read-ahead of older generations
+#   ('gop', keyframes)                          I-frame positions for cheaper seeks
+#   ('stop',)
+# Frames asked for by 'read' are announced on the result queue as (index, slot), slot -1 if it failed
+def run_decoder(video_path, frame_name, table_name, slot_num, frame_shape, requests, results):
+    frame_memory = SharedMemory(name=frame_name)
+    table_memory = SharedMemory(name=table_name)
+    frames, table = map_ring(frame_memory, table_memory, slot_num, frame_shape)
+    reader = open_frame_source(video_path)
+    generation = 0
+    pending = deque()
+    # Frames a reader is waiting for, in the order they were asked for
+    wanted = {}
+    slot = 0
+    while True:
+        try:
+            request = requests.get(block=not pending)
+        except queue.Empty:
+            request = None
+        if request is not None:
+            kind = request[0]
+            if kind == 'stop':
+                break
+            if kind == 'gop':
+                reader.set_gop_keyframes(request[1])
+            elif kind == 'cancel':
+                # Reads still waited for are kept
+                generation = request[1]
+                pending = deque(wanted)
+            elif kind == 'read':
+                # A read replaces the read-ahead of the previous one, the reads other threads wait for go first
+                generation = request[1]
+                wanted[request[2]] = None
+                pending = deque(wanted)
+            elif kind == 'read_ahead' and request[1] == generation:
+                pending.extend(index for index in range(request[2], request[2] + request[3]) if index not in pending)
+            # Serve all queued requests before decoding anything
+            continue
+
+        index = pending.popleft()
+        ring_slot = np.flatnonzero(table[:, 0] == index)
+        if len(ring_slot):
+            if index in wanted:
+                wanted.pop(index, None)
+                results.put((index, int(ring_slot[0])))
+            continue
+        frame = reader.read(index)
+        if frame is None:
+            # The read-ahead past a failed frame is dropped, the reads other threads wait for are not
+            wanted.pop(index, None)
+            pending = deque(wanted)
+            results.put((index, -1))
+            continue
+        sequence = table[slot, 1]
+        table[slot, 1] = sequence + 1
+        table[slot, 0] = index
+        if frame.shape == frames[slot].shape:
+            frames[slot][...] = frame
+        else:
+            cv2.resize(frame, (frame_shape[1], frame_shape[0]), dst=frames[slot])
+        table[slot, 1] = sequence + 2
+        if index in wanted:
+            wanted.pop(index, None)
+            results.put((index, slot))
+        slot = (slot + 1) % slot_num
+
+    reader.release()
+    del frames, table
+    frame_memory.close()
+    table_memory.close()
+
+
+# Frame reader backed by a decoder process, with the read interface of a frame source.
+# Frames are copied out of the shared-memory ring without pickling, and it is safe to share between threads:
+# no lock is held while a read waits for the process, one waiting thread at a time takes the answers off the
+# result queue and hands them to the others
+class ProcessFrameReader:
+    def __init__(self, video_path, frame_shape, slot_num=ring_slots):
+        frame_shape = (frame_shape[0], frame_shape[1], 3)
+        self.slot_num = slot_num
+        self.frame_memory = SharedMemory(create=True, size=slot_num * int(np.prod(frame_shape)))
+        self.table_memory = SharedMemory(create=True, size=slot_num * 2 * 8)
+        self.frames, self.table = map_ring(self.frame_memory, self.table_memory, slot_num, frame_shape)
+        self.table[:, 0] = -1
+        self.table[:, 1] = 0
+
+        # Spawn instead of fork, forking a process that runs Qt is not safe
+        context = multiprocessing.get_context('spawn')
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.process = context.Process(target=run_decoder,
+                                       args=(video_path, self.frame_memory.name, self.table_memory.name,
+                                             slot_num, frame_shape, self.requests, self.results),
+                                       daemon=True)
+        self.process.start()
+
+        self.lock = threading.Lock()
+        # Guards the answers taken off the result queue, by frame index, and whether a thread is taking them
+        self.condition = threading.Condition()
+        self.announced = {}
+        self.receiving = False
+        self.generation = 0
+        self.gop_keyframes = None
+        self.read_count = 0
+        self.hit_count = 0
+
+    def set_gop_keyframes(self, gop_keyframes):
+        if gop_keyframes is not self.gop_keyframes:
+            self.gop_keyframes = gop_keyframes
+            self.requests.put(('gop', gop_keyframes or None))
+
+    def get_stats(self):
+        return {'read': self.read_count, 'ring_hit': self.hit_count}
+
+    # Drop the read-ahead requested so far, called when the playhead jumps
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.requests.put(('cancel', self.generation))
+
+    # Copy a frame out of the ring, None if it is not there or was overwritten while copying
+    def _copy_from_ring(self, index):
+        for slot in np.flatnonzero(self.table[:, 0] == index):
+            sequence = self.table[slot, 1]
+            if sequence % 2:
+                continue
+            frame = self.frames[slot].copy()
+            if self.table[slot, 1] == sequence and self.table[slot, 0] == index:
+                return frame
+        return None
+
+    # Take one answer off the result queue for whichever thread waits for it, False if none came in time
+    def _receive(self, timeout):
+        try:
+            result = self.results.get(timeout=timeout)
+        except queue.Empty:
+            result = None
+        with self.condition:
+            self.receiving = False
+            if result is not None:
+                self.announced.pop(result[0], None)
+                self.announced[result[0]] = result[1]
+                while len(self.announced) > announced_size:
+                    del self.announced[next(iter(self.announced))]
+            self.condition.notify_all()
+        return result is not None
+
+    def _wait_for(self, index):
+        deadline = time.monotonic() + read_timeout
+        while self.process.is_alive():
+            with self.condition:
+                while index not in self.announced and self.receiving:
+                    if not self.condition.wait(timeout=max(deadline - time.monotonic(), 0)):
+                        return None
+                # Left in place, other threads may wait for the same frame
+                slot = self.announced.get(index)
+                if slot is None:
+                    self.receiving = True
+            if slot is None:
+                if not self._receive(max(deadline - time.monotonic(), 0)):
+                    return None
+                continue
+            if slot < 0:
+                return None
+            frame = self._copy_from_ring(index)
+            if frame is not None:
+                return frame
+            # Overwritten before it was copied
+            with self.condition:
+                self.announced.pop(index, None)
+            self.requests.put(('read', self.generation, index))
+        return None
+
+    # Read a frame, None is returned if it cannot be decoded
+    def read(self, index):
+        with self.lock:
+            frame = self._copy_from_ring(index)
+            if frame is None:
+                self.read_count += 1
+                # An answer left over from an earlier read is not for this one
+                with self.condition:
+                    self.announced.pop(index, None)
+                self.requests.put(('read', self.generation, index))
+            else:
+                self.hit_count += 1
+            # Requested before waiting, so the process decodes the next frames while this one is copied.
+            # Half of the ring is kept for frames the caller has not picked up yet
+            self.requests.put(('read_ahead', self.generation, index + 1, self.slot_num // 2))
+        if frame is None:
+            frame = self._wait_for(index)
+        return frame
+
+    def release(self):
+        if self.process.is_alive():
+            self.requests.put(('stop',))
+            self.process.join(timeout=1.0)
+            if self.process.is_alive():
+                self.process.terminate()
+        del self.frames, self.table
+        self.frame_memory.close()
+        self.frame_memory.unlink()
+        self.table_memory.close()
+        self.table_memory.unlink()
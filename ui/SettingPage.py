@@ -9,7 +9,10 @@ from qfluentwidgets import (MessageBox, SubtitleLabel, RadioButton, PushButton,
 
 setting_info = {
     'Auto Fill:': ['From first frame', 'From previous frame'],
-    'Simplify Annotation:': ['On', 'Off']
+    'Simplify Annotation:': ['On', 'Off'],
+    'Proxy Video:': ['Off', 'On'],
+    'Disk Cache:': ['Off', 'On'],
+    'Crop Borders:': ['Off', 'On']
 }
 
 
@@ -71,7 +74,7 @@ class SettingPage(QWidget):
         self.setWindowFlags(self.windowFlags() | Qt.WindowType.MSWindowsFixedSizeDialogHint)
         # self.setWindowFlag(Qt.WindowType.WindowStaysOnTopHint)
 
-        layout_list = [False, False]
+        layout_list = [False, False, False, False, False]
 
         self.setting_widget_list = []
 
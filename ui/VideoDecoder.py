@@ -0,0 +1,170 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from ui.FrameSource import open_frame_source
+
+# Number of frames decoded ahead of (or behind) the playhead
+read_ahead_size = 30
+# Keyframe previews shown while scrubbing are this many times smaller than the display frames
+preview_scale = 4
+
+
+# Bounded buffer of decoded frames around the playhead, frames farthest from the playhead are dropped first.
+# Keyframes also keep their original-resolution frame for the close-ups
+class FrameRing:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frames = OrderedDict()
+        self.origin_frames = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, index):
+        with self.lock:
+            return index in self.frames
+
+    def get(self, index):
+        with self.lock:
+            return self.frames.get(index)
+
+    def get_origin(self, index):
+        with self.lock:
+            return self.origin_frames.get(index)
+
+    def put(self, index, frame, playhead, origin_frame=None):
+        with self.lock:
+            self.frames[index] = frame
+            if origin_frame is not None:
+                self.origin_frames[index] = origin_frame
+            while len(self.frames) > self.capacity:
+                farthest = max(self.frames, key=lambda k: abs(k - playhead))
+                self.frames.pop(farthest)
+                self.origin_frames.pop(farthest, None)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.origin_frames.clear()
+
+
+# Decoder thread, reads frames sequentially ahead of the playhead into the ring buffer. It is idle once the window
+# is full, keyframe previews come from the keyframe store
+class ReadAheadDecoder(QThread):
+    FrameDecoded = pyqtSignal(int)
+
+    def __init__(self, video_path, video_len, scaling_size, read_ahead=read_ahead_size, get_gop_keyframes=None,
+                 keyframes_list=None, reader=None, keep_origin=True, crop=None):
+        super().__init__()
+        self.keyframes = set(keyframes_list or [])
+        # Whether decoded keyframes are kept at full resolution for the close-ups, not when reading a proxy
+        self.keep_origin = keep_origin
+        # Cuts the active region out of a source frame before it is resized for display
+        self.crop = crop
+        self.video_path = video_path
+        # Shared reader (e.g. a ProcessFrameReader), otherwise the thread opens its own frame source
+        self.reader = reader
+        # The GOP index may still be building when playback starts, so it is looked up per read
+        self.get_gop_keyframes = get_gop_keyframes
+        self.video_len = video_len
+        self.scaling_size = list(scaling_size)
+        self.read_ahead = read_ahead
+        self.ring = FrameRing(capacity=2 * read_ahead + 1)
+
+        self.condition = threading.Condition()
+        self.running = True
+        self.playhead = 0
+        self.direction = 1
+        # Increased whenever the playhead jumps, frames of an older generation are thrown away
+        self.generation = 0
+        self.failed = set()
+
+    # Move the playhead, called from the GUI thread
+    def set_playhead(self, index):
+        with self.condition:
+            if index == self.playhead:
+                return
+            if abs(index - self.playhead) > self.read_ahead:
+                self.generation += 1
+            self.direction = 1 if index > self.playhead else -1
+            self.playhead = index
+            self.condition.notify()
+
+    def set_scaling_size(self, scaling_size):
+        with self.condition:
+            self.scaling_size = list(scaling_size)
+            self.generation += 1
+            self.ring.clear()
+            self.condition.notify()
+
+    def is_decoded(self, index):
+        return index in self.ring
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.wait()
+
+    # Choose the next frame to decode, the playhead itself always comes first
+    def _next_target(self):
+        playhead = self.playhead
+        if playhead not in self.ring and playhead not in self.failed:
+            return playhead
+        if self.direction > 0:
+            window = range(playhead + 1, min(playhead + self.read_ahead, self.video_len - 1) + 1)
+        else:
+            # Scrubbing backwards: fill the window behind the playhead with one forward pass
+            window = range(max(playhead - self.read_ahead, 0), playhead)
+        for index in window:
+            if index not in self.ring and index not in self.failed:
+                return index
+        return None
+
+    def run(self):
+        if self.reader is None:
+            source = reader = open_frame_source(self.video_path)
+        else:
+            source = None
+            reader = self.reader
+        read_generation = self.generation
+        while True:
+            with self.condition:
+                target = self._next_target()
+                while self.running and target is None:
+                    self.condition.wait()
+                    target = self._next_target()
+                if not self.running:
+                    break
+                generation = self.generation
+                scaling_size = self.scaling_size
+
+            if self.get_gop_keyframes is not None:
+                reader.set_gop_keyframes(self.get_gop_keyframes())
+            # The playhead jumped, drop the read-ahead a decoder process is still working on
+            if generation != read_generation and hasattr(reader, 'cancel'):
+                reader.cancel()
+            read_generation = generation
+            origin_frame = reader.read(target)
+            if origin_frame is None:
+                with self.condition:
+                    self.failed.add(target)
+                self.FrameDecoded.emit(target)
+                continue
+            frame = origin_frame if self.crop is None else self.crop(origin_frame)
+            frame = cv2.resize(frame, (scaling_size[1], scaling_size[0]))
+            if target not in self.keyframes or not self.keep_origin:
+                origin_frame = None
+
+            # Checked and stored under the lock, so a frame of an old display size never gets into a cleared ring
+            with self.condition:
+                if generation != self.generation:
+                    continue
+                self.ring.put(target, frame, self.playhead, origin_frame)
+            self.FrameDecoded.emit(target)
+        if source is not None:
+            source.release()
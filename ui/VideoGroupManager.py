@@ -1,13 +1,38 @@
 import sys
 import os
 import json
+import math
+import bisect
+import base64
 
-from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtWidgets import QHBoxLayout, QApplication, QWidget
+import numpy as np
+
+from PyQt6.QtCore import Qt, QRectF, pyqtSignal
+from PyQt6.QtGui import QColor, QCursor
+from PyQt6.QtWidgets import QHBoxLayout, QApplication, QWidget, QToolTip
 
 from qfluentwidgets import (SubtitleLabel, Slider, SpinBox)
 
+from ui.DatasetManifest import get_sample_id, load_manifest
+from ui.VideoPrefetch import VideoPrefetcher
+from ui.VideoPoster import load_poster
+from ui.AnnotationIndex import AnnotationIndex, AnnotationIndexer, summarize_annotations, summarize_missing
+
+
+# Path of the annotation log of a sample: log/<class>/<log name>, the log name is given by the manifest
+# (see assign_log_names), usually the video name without extension or the folder name
+def get_log_path(data_path, sample_class, log_name):
+    return os.path.join(data_path, 'log', sample_class, log_name)
+
+
+# Probed metadata of a sample, kept in the sample table next to its name, id and log name
+meta_fields = [('fps', np.float64), ('height', np.int32), ('width', np.int32), ('length', np.int64),
+               ('keyframes', np.int64)]
 
+
+# Index of the samples of one dataset root. Samples are kept as compact arrays: the class of each sample, the first
+# sample of each class, and one structured array with the name, id, log name and probed metadata of every sample.
+# The entry dict of a sample is built when it is asked for, no dict per sample is kept
 class DatasetLoader:
     def __init__(self, data_path):
         # Check the dataset
@@ -15,48 +40,218 @@ class DatasetLoader:
         log_folder = os.path.join(data_path, 'log')
         assert os.path.exists(sample_folder)
         assert os.path.exists(log_folder)
+        self.data_path = data_path
+
+        # Load videos from the cached manifest, a sample is a video file or a folder of frames.
+        # Classes and samples are in natural name order, so indices do not depend on the file system
+        manifest = load_manifest(data_path)
+        self.class_list = list(manifest['classes'])
+        class_sizes = [len(class_entry['samples']) for class_entry in manifest['classes'].values()]
+        names = [sample for class_entry in manifest['classes'].values() for sample in class_entry['samples']]
+        entries = [entry for class_entry in manifest['classes'].values() for entry in class_entry['samples'].values()]
+        metas = [entry.get('meta') or {} for entry in entries]
+        codecs = [meta.get('codec', '') for meta in metas]
+        logs = [entry['log'] for entry in entries]
+        self.samples = np.zeros(len(entries), dtype=[
+            ('name', 'U{}'.format(max(map(len, names), default=1))),
+            ('id', 'U16'),
+            ('log', 'U{}'.format(max(map(len, logs), default=1))),
+            ('probed', np.bool_),
+            ('codec', 'U{}'.format(max(map(len, codecs), default=1)))] + meta_fields)
+        self.samples['name'] = names
+        self.samples['id'] = [entry['id'] for entry in entries]
+        self.samples['log'] = logs
+        self.samples['probed'] = [entry.get('meta') is not None for entry in entries]
+        self.samples['codec'] = codecs
+        for field, _ in meta_fields:
+            self.samples[field] = [meta.get(field, 0) for meta in metas]
+        # Samples by id, the id is derived from the class and name, so a sample is found by a binary search
+        self.id_order = np.argsort(self.samples['id'], kind='stable')
+        self.class_offsets = np.zeros(len(class_sizes) + 1, dtype=np.int64)
+        self.class_offsets[1:] = np.cumsum(class_sizes)
+        self.sample_classes = np.repeat(np.arange(len(class_sizes), dtype=np.int32), class_sizes)
 
-        # Load videos
-        video_list = []
-        class_list = os.listdir(sample_folder)
-        for class_index, sample_class in enumerate(class_list):
-            class_path = os.path.join(sample_folder, sample_class)
-            sample_list = os.listdir(class_path)
-            for sample_index, sample in enumerate(sample_list):
-                if sample[-3::] != 'mp4':
-                    continue
-                sample_path = os.path.join(class_path, sample)
-                video_list.append({'video_name': os.path.join(sample_class, sample),
-                                   'class_index': class_index,
-                                   'sample_index': sample_index,
-                                   'sample_class': sample_class,
-                                   'sample_name': sample,
-                                   'sample_path': sample_path,
-                                   'data_path': data_path
-                                   })
-
-        self.video_list = video_list
-
-    def __add__(self, other):
-        if isinstance(other, DatasetLoader):
-            self.video_list += other.video_list
-            index_dict = {}
-            for index, sample in enumerate(self.video_list):
-                sample_name = sample['sample_class']
-                if sample_name not in index_dict:
-                    index_dict[sample_name] = {'class_index': sample['class_index'], 'sample_index': 0}
-                else:
-                    self.video_list[index]['class_index'] = index_dict[sample_name]['class_index']
-                self.video_list[index]['sample_index'] = index_dict[sample_name]['sample_index']
-                index_dict[sample_name]['sample_index'] += 1
-
-        return self
+    def __len__(self):
+        return len(self.samples)
+
+    # Probed metadata of a sample, None if it was not probed yet
+    def get_meta(self, index):
+        row = self.samples[index]
+        if not row['probed']:
+            return None
+        meta = {field: row[field].item() for field, _ in meta_fields}
+        meta['codec'] = str(row['codec'])
+        return meta
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('sample index out of range')
+        class_index = int(self.sample_classes[index])
+        sample_class = self.class_list[class_index]
+        row = self.samples[index]
+        sample = str(row['name'])
+        return {'video_name': os.path.join(sample_class, sample),
+                'class_index': class_index,
+                'sample_index': index - int(self.class_offsets[class_index]),
+                'sample_class': sample_class,
+                'sample_name': sample,
+                'sample_id': str(row['id']),
+                'meta': self.get_meta(index),
+                'sample_path': os.path.join(self.data_path, 'classification', sample_class, sample),
+                'log_path': get_log_path(self.data_path, sample_class, str(row['log'])),
+                'data_path': self.data_path
+                }
+
+    # Index of a sample given its class and name, None if the root has no such sample
+    def find(self, sample_class, sample_name):
+        sample_ids = self.samples['id']
+        sample_id = get_sample_id(sample_class, sample_name)
+        position = int(np.searchsorted(sample_ids, sample_id, sorter=self.id_order))
+        while position < len(self.id_order) and sample_ids[self.id_order[position]] == sample_id:
+            index = int(self.id_order[position])
+            if self.samples['name'][index] == sample_name and \
+                    self.class_list[self.sample_classes[index]] == sample_class:
+                return index
+            position += 1
+        return None
+
+
+# Several dataset roots seen as one dataset. Classes of the same name are merged: they share the class index of
+# their first root, and their samples are numbered on from the previous roots. Adding a root only indexes that root
+class MergedDataset:
+    def __init__(self, data_loader_list=()):
+        self.roots = []
+        # First global index of each root
+        self.root_offsets = []
+        # Root position by the real path of its folder, a root added twice is detected whatever the path spelling
+        self.root_lookup = {}
+        self.class_indices = {}
+        self.class_sizes = {}
+        # Per root: global class index and first global sample index of each of its classes
+        self.root_class_indices = []
+        self.root_sample_starts = []
+        self.length = 0
+        for data_loader in data_loader_list:
+            self.add_root(data_loader)
+
+    # Add the samples of a dataset root, False if the root is already part of the dataset
+    def add_root(self, data_loader):
+        real_path = os.path.realpath(data_loader.data_path)
+        if real_path in self.root_lookup:
+            return False
+        class_indices = np.zeros(len(data_loader.class_list), dtype=np.int32)
+        sample_starts = np.zeros(len(data_loader.class_list), dtype=np.int64)
+        for local_index, sample_class in enumerate(data_loader.class_list):
+            class_indices[local_index] = self.class_indices.setdefault(sample_class, len(self.class_indices))
+            sample_starts[local_index] = self.class_sizes.get(sample_class, 0)
+            self.class_sizes[sample_class] = sample_starts[local_index] + \
+                int(data_loader.class_offsets[local_index + 1] - data_loader.class_offsets[local_index])
+        self.root_lookup[real_path] = len(self.roots)
+        self.roots.append(data_loader)
+        self.root_offsets.append(self.length)
+        self.root_class_indices.append(class_indices)
+        self.root_sample_starts.append(sample_starts)
+        self.length += len(data_loader)
+        return True
 
     def __len__(self):
-        return len(self.video_list)
+        return self.length
 
     def __getitem__(self, index):
-        return self.video_list[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('sample index out of range')
+        root_index = bisect.bisect_right(self.root_offsets, index) - 1
+        data_loader = self.roots[root_index]
+        local_index = index - self.root_offsets[root_index]
+        sample = data_loader[local_index]
+        local_class = int(data_loader.sample_classes[local_index])
+        sample['class_index'] = int(self.root_class_indices[root_index][local_class])
+        sample['sample_index'] += int(self.root_sample_starts[root_index][local_class])
+        return sample
+
+    # Global index of a sample given its class and name, searched in the given root or in the roots in order.
+    # None if there is no such sample
+    def find(self, sample_class, sample_name, data_path=None):
+        if data_path is None:
+            root_list = range(len(self.roots))
+        else:
+            root_index = self.root_lookup.get(os.path.realpath(data_path))
+            root_list = [] if root_index is None else [root_index]
+        for root_index in root_list:
+            local_index = self.roots[root_index].find(sample_class, sample_name)
+            if local_index is not None:
+                return self.root_offsets[root_index] + local_index
+        return None
+
+    # Global index of a sample given its path (<root>/classification/<class>/<sample>), None if it is not indexed
+    def find_path(self, sample_path):
+        class_path, sample_name = os.path.split(os.path.normpath(sample_path))
+        classification_path, sample_class = os.path.split(class_path)
+        return self.find(sample_class, sample_name, data_path=os.path.dirname(classification_path))
+
+
+# Dataset slider whose drags only move the handle, the value is set once the mouse is released.
+# The fluent Slider sets its value at every mouse move, whatever the tracking setting.
+# Below the groove, a heatmap shows how much of each video is annotated
+class DatasetSlider(Slider):
+    def __init__(self, orientation, parent=None):
+        super().__init__(orientation, parent)
+        self.annotation_index = None
+        self.setTracking(False)
+        self.handle.pressed.disconnect()
+        self.handle.released.disconnect()
+        self.handle.pressed.connect(lambda: self.setSliderDown(True))
+        self.handle.released.connect(lambda: self.setSliderDown(False))
+        self.sliderMoved.connect(self._adjustHandlePos)
+
+    def mousePressEvent(self, e):
+        self.setSliderDown(True)
+        self.setSliderPosition(self._posToValue(e.pos()))
+
+    def mouseMoveEvent(self, e):
+        self.setSliderPosition(self._posToValue(e.pos()))
+
+    def mouseReleaseEvent(self, e):
+        self.setSliderDown(False)
+
+    # The handle follows the dragged position, not the value
+    def _adjustHandlePos(self):
+        total = max(self.maximum() - self.minimum(), 1)
+        delta = int((self.sliderPosition() - self.minimum()) / total * self.grooveLength)
+        self.handle.move(delta, 0)
+
+    def set_annotation_index(self, annotation_index):
+        self.annotation_index = annotation_index
+        self.update()
+
+    # Completion of the videos under each pixel of the groove, from red (nothing labeled) to green (done).
+    # Videos whose logs were not read yet are left grey
+    def _drawHorizonGroove(self, painter):
+        super()._drawHorizonGroove(painter)
+        if self.annotation_index is None or not len(self.annotation_index):
+            return
+        completion = self.annotation_index.get_completion()
+        r = self.handle.width() / 2
+        width = max(int(self.width() - r * 2), 1)
+        # Each pixel column shows the mean completion of the videos it covers
+        edges = (np.arange(width) * len(completion)) // width
+        if len(completion) <= width:
+            values = completion[edges]
+        else:
+            ready = ~np.isnan(completion)
+            counts = np.add.reduceat(ready.astype(np.int64), edges)
+            sums = np.add.reduceat(np.where(ready, completion, 0), edges)
+            values = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        for x, value in enumerate(values.tolist()):
+            if not math.isnan(value):
+                painter.setBrush(QColor.fromHsvF(value / 3, 0.8, 0.85))
+            else:
+                painter.setBrush(QColor(128, 128, 128, 80))
+            painter.drawRect(QRectF(r + x, r + 5, 1, 3))
 
 
 class VideoGroupManager(QWidget):
@@ -68,22 +263,34 @@ class VideoGroupManager(QWidget):
         self.dataset = None
 
         self.current_video_index = 0
+        # Keeps the previous and next video opened in the background
+        self.prefetcher = VideoPrefetcher()
+        # Annotation summary of every video, read from the logs in the background and updated on save
+        self.annotation_index = AnnotationIndex()
+        self.annotationIndexer = AnnotationIndexer(self)
 
         self.videoNameLabel = SubtitleLabel('Video_Name')
 
         self.currentFrameEdit = SpinBox(self)
         self.currentFrameEdit.setAccelerated(True)
         self.currentFrameEdit.setMaximum(9999)
+        # Typing an index switches once it is entered, not at every digit
+        self.currentFrameEdit.setKeyboardTracking(False)
         self.currentFrameEdit.valueChanged.connect(self._switch_by_index)
 
         self.separatorLabel = SubtitleLabel("/")
 
         self.totalFrameLabel = SubtitleLabel('Video_num')
 
-        self.progressBar = Slider(Qt.Orientation.Horizontal, self)
+        self.progressBar = DatasetSlider(Qt.Orientation.Horizontal, self)
         # self.progressBar.setFixedWidth(200)
         self.progressBar.setMinimumWidth(200)
+        # While the slider is dragged only the name and poster of the video under the handle are shown,
+        # the video is switched once on release
         self.progressBar.valueChanged.connect(self._switch_by_index)
+        self.progressBar.sliderMoved.connect(self._preview_by_index)
+        self.progressBar.sliderReleased.connect(self._end_preview)
+        self.annotationIndexer.IndexUpdated.connect(self.progressBar.update)
 
         # layout
         layout = QHBoxLayout(self)
@@ -109,11 +316,7 @@ class VideoGroupManager(QWidget):
         if self.dataset is None:
             return None
         else:
-            sample_path = self.dataset[item]['sample_path']
-            log_path = sample_path
-            log_path = log_path.replace('classification', 'log')
-            log_path = log_path.replace('.mp4', '.json')
-            return sample_path, log_path
+            return self.dataset[item]['sample_path'], self.dataset[item]['log_path']
 
     def get_current_video_name(self):
         if self.dataset is None:
@@ -125,15 +328,33 @@ class VideoGroupManager(QWidget):
         if self.dataset is None:
             return None
         else:
-            sample_path = self.dataset[self.current_video_index]['sample_path']
-            log_path = sample_path
-            log_path = log_path.replace('classification', 'log')
-            log_path = log_path.replace('.mp4', '.json')
-            return log_path
+            return self.dataset[self.current_video_index]['log_path']
+
+    # Get the prefetched video of an index for VideoManager, None if it is not ready yet
+    def take_prefetched(self, index):
+        if self.dataset is None:
+            return None
+        return self.prefetcher.take(self.dataset[index]['sample_path'], self.dataset[index]['log_path'])
+
+    # Prefetch the neighbours of the current video, the next one first since videos are mostly annotated in order
+    def prefetch_neighbours(self):
+        video_list = []
+        for index in (self.current_video_index + 1, self.current_video_index - 1):
+            if 0 <= index < len(self):
+                video_list.append((self.dataset[index]['sample_path'], self.dataset[index]['log_path']))
+        self.prefetcher.request(video_list)
+
+    def stop_prefetch(self):
+        self.prefetcher.stop()
 
     def load_dataset(self, data_path):
 
-        self.dataset = DatasetLoader(data_path=data_path)
+        self.prefetcher.clear()
+        self.annotationIndexer.clear()
+        self.dataset = MergedDataset([DatasetLoader(data_path=data_path)])
+        self.annotation_index = AnnotationIndex(len(self.dataset))
+        self.progressBar.set_annotation_index(self.annotation_index)
+        self.annotationIndexer.request(self.annotation_index, self.dataset, 0, len(self.dataset))
         self.current_video_index = 0
         video_name = self.dataset[0]['video_name']
 
@@ -143,13 +364,48 @@ class VideoGroupManager(QWidget):
         self.currentFrameEdit.setMaximum(len(self) - 1)
         self.totalFrameLabel.setText(str(len(self) - 1))
         self.VideoChanged.emit(0)
+        self.prefetch_neighbours()
 
+    # Add a dataset root to the loaded ones, False if it is already loaded
     def add_dataset(self, data_path):
-        new_dataset = DatasetLoader(data_path=data_path)
-        self.dataset = self.dataset + new_dataset
+        if self.dataset is None:
+            self.load_dataset(data_path)
+            return True
+        start = len(self.dataset)
+        if not self.dataset.add_root(DatasetLoader(data_path=data_path)):
+            return False
+        self.annotation_index.extend(len(self.dataset))
+        self.annotationIndexer.request(self.annotation_index, self.dataset, start, len(self.dataset))
         self.progressBar.setMaximum(len(self) - 1)
         self.currentFrameEdit.setMaximum(len(self) - 1)
         self.totalFrameLabel.setText(str(len(self) - 1))
+        self.prefetch_neighbours()
+        return True
+
+    def stop_index(self):
+        self.annotationIndexer.stop()
+
+    # First video after the current one that still needs work, wrapping around to the current one.
+    # None if every video is annotated
+    def next_incomplete_video(self):
+        if self.dataset is None:
+            return None
+        return self.annotation_index.next_incomplete(self.current_video_index)
+
+    def switch_to(self, index):
+        self._switch_by_index(index)
+
+    # Count the keyframes of a video without a log once its length is probed. The row may not be indexed yet, the
+    # indexer then keeps this summary, it does not replace a stored one
+    def meta_probed(self, sample_path, meta):
+        if self.dataset is None:
+            return
+        index = self.dataset.find_path(sample_path)
+        if index is None or self.annotation_index.get(index) not in (None, (0, 0, 0, 0)) or \
+                os.path.exists(self.dataset[index]['log_path']):
+            return
+        self.annotation_index.set(index, summarize_missing(meta))
+        self.progressBar.update()
 
     def switch_by_wheel(self, direction: bool):
         if direction and self.current_video_index > 0:
@@ -168,20 +424,35 @@ class VideoGroupManager(QWidget):
         video_name = self.dataset[index]['video_name']
         self.videoNameLabel.setText(video_name)
         self.VideoChanged.emit(index)
+        self.prefetch_neighbours()
+
+    # Show the video under the dragged slider handle, without saving or opening anything
+    def _preview_by_index(self, index):
+        if self.dataset is None:
+            return
+        sample = self.dataset[index]
+        self.videoNameLabel.setText(sample['video_name'])
+        poster = load_poster(sample['sample_path'])
+        text = sample['video_name'] if poster is None else '<img src="data:image/jpeg;base64,{}"><br>{}'.format(
+            base64.b64encode(poster).decode('ascii'), sample['video_name'])
+        QToolTip.showText(QCursor.pos(), text, self.progressBar)
+
+    def _end_preview(self):
+        QToolTip.hideText()
+        if self.dataset is not None:
+            self.videoNameLabel.setText(self.dataset[self.current_video_index]['video_name'])
 
     def save_annotation_log(self, annotation_log, prompt_log):
-        data_path = self.dataset[self.current_video_index]['data_path']
-        sample_class = self.dataset[self.current_video_index]['sample_class']
-        sample_name = self.dataset[self.current_video_index]['sample_name']
-        log_folder_path = os.path.join(data_path, 'log', sample_class)
+        log_path = self.dataset[self.current_video_index]['log_path']
+        log_folder_path = os.path.dirname(log_path)
         if not os.path.exists(log_folder_path):
             os.makedirs(log_folder_path)
-        log_path = os.path.join(log_folder_path, sample_name)
-        log_path = log_path.replace('.mp4', '.json')
         log_data = {'Tracking_Annotation': annotation_log, 'Text_Annotation': prompt_log}
         with open(log_path, 'w') as f:
             data = json.dumps(log_data)
             f.write(data)
+        self.annotation_index.set(self.current_video_index, summarize_annotations(annotation_log, prompt_log))
+        self.progressBar.update()
 
     def save_location_log(self, location):
         pass
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import threading
+
+import cv2
+
+# Serializes read-modify-write cycles of sidecar files
+sidecar_lock = threading.Lock()
+# Seconds the length probe may spend on one video
+probe_timeout = 5.0
+
+
+# Raised when a video cannot be opened or has no decodable frame
+class VideoOpenError(Exception):
+    pass
+
+
+# Path of the metadata sidecar of a video, stored next to its annotation log
+def get_sidecar_path(log_path):
+    return os.path.splitext(log_path)[0] + '.meta.json'
+
+
+# Size and modification time, used to invalidate cached information
+def get_file_stamp(video_path):
+    stat = os.stat(video_path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# Read the sidecar, an empty dict is returned if it is missing or the video changed since it was written
+def load_sidecar(video_path, log_path):
+    sidecar_path = get_sidecar_path(log_path)
+    if not os.path.exists(sidecar_path):
+        return {}
+    try:
+        with open(sidecar_path, 'r') as f:
+            sidecar = json.load(f)
+        if sidecar.get('stamp') != get_file_stamp(video_path):
+            return {}
+        return sidecar
+    except (OSError, ValueError):
+        return {}
+
+
+# Read an annotation log, None if it is missing or broken
+def load_log_data(log_path):
+    if not os.path.exists(log_path):
+        return None
+    try:
+        with open(log_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Get the frames that require annotation: every 30th frame and the last one
+def get_keyframes_list(video_len):
+    keyframes_list = []
+    for i in range(video_len):
+        if i % 30 == 0 or i == video_len - 1:
+            keyframes_list.append(i)
+    return keyframes_list
+
+
+# Merge entries into the sidecar. It is written under a temporary name, unique per process since probing
+# processes write sidecars too, so a reader never sees a partial file
+def update_sidecar(video_path, log_path, **entries):
+    with sidecar_lock:
+        sidecar = load_sidecar(video_path, log_path)
+        sidecar.update(entries)
+        sidecar['stamp'] = get_file_stamp(video_path)
+        sidecar_path = get_sidecar_path(log_path)
+        os.makedirs(os.path.dirname(sidecar_path), exist_ok=True)
+        temp_path = '{}.{}.part'.format(sidecar_path, os.getpid())
+        with open(temp_path, 'w') as f:
+            f.write(json.dumps(sidecar))
+        os.replace(temp_path, sidecar_path)
+    return sidecar
+
+
+# Index the I-frames of a video. Packets are read without decoding them, the packet size
+# is used as decode cost. The index is empty if the backend cannot report key frames
+def build_gop_index(video_path):
+    if os.path.isdir(video_path):
+        return {'keyframes': [], 'gop_cost': []}
+    video = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    if not video.isOpened() or not video.set(cv2.CAP_PROP_FORMAT, -1):
+        video.release()
+        return {'keyframes': [], 'gop_cost': []}
+    keyframes = []
+    gop_cost = []
+    index = 0
+    while True:
+        s, packet = video.read()
+        if not s:
+            break
+        if video.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+            keyframes.append(index)
+            gop_cost.append(0)
+        if gop_cost:
+            gop_cost[-1] += int(packet.size)
+        index += 1
+    video.release()
+    return {'keyframes': keyframes, 'gop_cost': gop_cost}
+
+
+# Load the I-frame index from the sidecar, or build and store it
+def load_gop_index(video_path, log_path):
+    gop_index = load_sidecar(video_path, log_path).get('gop')
+    if gop_index is None:
+        gop_index = build_gop_index(video_path)
+        update_sidecar(video_path, log_path, gop=gop_index)
+    return gop_index
+
+
+# Find the real number of frames with a bounded search, the frame count in the metadata is often wrong.
+# Returns the length and whether it was verified before the timeout
+def probe_length(video, reported_len, timeout=probe_timeout):
+    deadline = time.monotonic() + timeout
+
+    def readable(index):
+        video.set(cv2.CAP_PROP_POS_FRAMES, index)
+        return video.grab()
+
+    if not readable(0):
+        raise VideoOpenError('No decodable frame')
+    if reported_len > 1 and readable(reported_len - 1):
+        return reported_len, True
+    # Frame lo can be decoded, frame hi can not
+    lo = 0
+    if reported_len > 1:
+        hi = reported_len - 1
+    else:
+        # No usable frame count, search upwards exponentially
+        step = 1
+        while readable(lo + step):
+            lo += step
+            step *= 2
+            if time.monotonic() > deadline:
+                return lo + 1, False
+        hi = lo + step
+    while hi - lo > 1:
+        if time.monotonic() > deadline:
+            return lo + 1, False
+        mid = (lo + hi) // 2
+        if readable(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo + 1, True
+
+
+# Get fps, size and verified length of a video. The result is cached in the sidecar when a log path is given
+def probe_video(video_path, log_path=None, video=None):
+    if not os.path.exists(video_path):
+        raise VideoOpenError('Video not found: {}'.format(video_path))
+    if log_path is not None:
+        meta = load_sidecar(video_path, log_path).get('meta')
+        if meta is not None:
+            return meta
+    capture = video if video is not None else cv2.VideoCapture(video_path)
+    try:
+        if not capture.isOpened():
+            raise VideoOpenError('Cannot open video: {}'.format(video_path))
+        meta = {'fps': capture.get(cv2.CAP_PROP_FPS),
+                'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))}
+        try:
+            length, verified = probe_length(capture, int(capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+        except VideoOpenError:
+            raise VideoOpenError('No decodable frame in video: {}'.format(video_path))
+        meta['length'] = length
+    finally:
+        if video is None:
+            capture.release()
+    if verified and log_path is not None:
+        update_sidecar(video_path, log_path, meta=meta)
+    return meta
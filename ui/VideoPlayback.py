@@ -0,0 +1,83 @@
+import time
+
+from PyQt6.QtCore import Qt, QObject, QTimer, pyqtSignal
+
+# Playback speeds offered by the play bar
+playback_speeds = [0.25, 0.5, 1.0, 2.0, 4.0, 8.0]
+# Seconds between two reports of the achieved frame rate
+fps_report_interval = 1.0
+
+
+# Real-time playback engine. Frames are scheduled from the video fps against a monotonic clock,
+# when drawing falls behind the late frames are dropped so playback never drifts
+class PlaybackEngine(QObject):
+    FrameDue = pyqtSignal(int)
+    Finished = pyqtSignal()
+    FpsMeasured = pyqtSignal(float, float)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self._tick)
+
+        self.fps = 25.0
+        self.speed = 1.0
+        self.video_len = 0
+        # The clock is rebased whenever playback starts or the speed changes
+        self.start_time = 0.0
+        self.start_frame = 0
+        self.current_frame = 0
+
+        # Statistics
+        self.dropped_frames = 0
+        self.shown_frames = 0
+        self.report_time = 0.0
+
+    def isActive(self):
+        return self.timer.isActive()
+
+    def get_target_fps(self):
+        return self.fps * self.speed
+
+    def start(self, frame_index, fps, video_len):
+        self.fps = fps if fps > 0 else 25.0
+        self.video_len = video_len
+        self.dropped_frames = 0
+        self._rebase(frame_index)
+        # Tick twice per frame period, so a frame is never shown more than half a period late
+        self.timer.start(max(1, min(20, int(500 / self.get_target_fps()))))
+
+    def stop(self):
+        self.timer.stop()
+
+    def set_speed(self, speed):
+        self.speed = speed
+        if self.isActive():
+            self._rebase(self.current_frame)
+            self.timer.setInterval(max(1, min(20, int(500 / self.get_target_fps()))))
+
+    # Count a frame that was actually drawn, the achieved frame rate is based on this
+    def frame_shown(self):
+        self.shown_frames += 1
+
+    def _rebase(self, frame_index):
+        self.start_time = self.report_time = time.monotonic()
+        self.start_frame = self.current_frame = frame_index
+        self.shown_frames = 0
+
+    def _tick(self):
+        now = time.monotonic()
+        due_frame = self.start_frame + int((now - self.start_time) * self.get_target_fps())
+        due_frame = min(due_frame, self.video_len - 1)
+        if due_frame > self.current_frame:
+            self.dropped_frames += due_frame - self.current_frame - 1
+            self.current_frame = due_frame
+            self.FrameDue.emit(due_frame)
+        if now - self.report_time >= fps_report_interval:
+            self.FpsMeasured.emit(self.shown_frames / (now - self.report_time), self.get_target_fps())
+            self.report_time = now
+            self.shown_frames = 0
+        if self.current_frame >= self.video_len - 1:
+            self.stop()
+            self.Finished.emit()
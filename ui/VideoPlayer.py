@@ -1,20 +1,45 @@
 import copy
-import json
 import sys, os
+import bisect
+import threading
+from collections import OrderedDict
 import cv2
 import numpy as np
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout
 )
 from PyQt6.QtCore import Qt, QTimer, pyqtSignal
-from PyQt6.QtGui import QImage, QPixmap, QColor, QGuiApplication
+from PyQt6.QtGui import QImage, QPainter, QGuiApplication
 
 from ui.VideoProgressBar import MarkerOverlay, VideoPlayBar
+from ui.VideoDecoder import ReadAheadDecoder, read_ahead_size
+from ui.FrameSource import open_frame_source
+from ui.ProcessDecoder import ProcessFrameReader
+from ui.VideoProxy import find_proxy
+from ui.DiskCache import DiskCacheFiller, open_disk_cache
+from ui.ActiveRegion import crop_active_region, load_active_region
+from ui.KeyframeStore import KeyframeStoreBuilder, open_keyframe_store
+from ui.CompressedCache import CompressedFrameCache, compressed_cache_size
+from ui.VideoMeta import VideoOpenError, get_keyframes_list, load_gop_index, load_log_data
+from ui.VideoPlayback import PlaybackEngine, playback_speeds
 
 # Color of the visualization points (not important)
 point_color = (255, 0, 0)
 highlight_color = (0, 255, 0)
 
+# Memory budget of the decoded frame cache (MB)
+frame_cache_size = 256
+# Memory budget of the original-resolution keyframes kept for the close-ups (MB)
+origin_cache_size = 128
+# Magnification of the close-ups relative to the main view
+zoom_levels = [2, 3, 5, 8, 12]
+# Decode in a separate process and pass frames through shared memory, keeps the GUI responsive on heavy videos
+decode_in_process = False
+# Keep display-resolution frames in a memory-mapped file on disk, so reopened videos need no decoding
+use_disk_cache = False
+# Crop the black border around the field of view of endoscope footage, annotations stay in full-frame pixels
+crop_borders = False
+
 
 # Define annotation window
 class LabelingWidget(QLabel):
@@ -25,10 +50,28 @@ class LabelingWidget(QLabel):
     def __init__(self):
         super().__init__()
         self.setMouseTracking(True)
-        ori_frame = np.zeros((400, 800, 3), dtype=np.uint8)
-        image = QImage(ori_frame.data, 800, 400, 2400, QImage.Format.Format_RGB888)
-        pixmap = QPixmap.fromImage(image)
-        self.setPixmap(pixmap)
+        # Display buffer, frames are rendered into it and painted without a QPixmap conversion
+        self.canvas = None
+        self.image = None
+        self.get_canvas((400, 800, 3))
+
+    # Get the display buffer, it is only reallocated when the frame shape changes
+    def get_canvas(self, shape):
+        if self.canvas is None or self.canvas.shape != tuple(shape):
+            height, width, c = shape
+            self.canvas = np.zeros(shape, dtype=np.uint8)
+            self.image = QImage(self.canvas.data, width, height, c * width, QImage.Format.Format_BGR888)
+            self.setFixedSize(width, height)
+        return self.canvas
+
+    def clear(self):
+        self.canvas.fill(0)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawImage(0, 0, self.image)
+        painter.end()
 
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
@@ -42,64 +85,126 @@ class LabelingWidget(QLabel):
             self.Canceled.emit()
 
 
+# Decoded frame cache, frames are evicted in LRU order once the memory budget is exceeded
+class FrameCache:
+    def __init__(self, cache_size=frame_cache_size):
+        self.budget = int(cache_size * 1024 * 1024)
+        self.frames = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, key):
+        return key in self.frames
+
+    def get(self, key):
+        frame = self.frames.get(key)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.frames.move_to_end(key)
+        self.hits += 1
+        return frame
+
+    def put(self, key, frame):
+        if key in self.frames:
+            self.size -= self.frames.pop(key).nbytes
+        if frame.nbytes > self.budget:
+            return
+        self.frames[key] = frame
+        self.size += frame.nbytes
+        while self.size > self.budget:
+            _, old_frame = self.frames.popitem(last=False)
+            self.size -= old_frame.nbytes
+
+    def set_budget(self, cache_size):
+        self.budget = int(cache_size * 1024 * 1024)
+        while self.size > self.budget:
+            _, old_frame = self.frames.popitem(last=False)
+            self.size -= old_frame.nbytes
+
+    def clear(self):
+        self.frames.clear()
+        self.size = 0
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'frames': len(self.frames),
+                'size_mb': self.size / 1024 / 1024, 'budget_mb': self.budget / 1024 / 1024}
+
+
+# Get the point and text annotations of a log, keyframes without a log start with one empty point.
+# Points of old-version logs are in display pixels, they are flagged so that VideoManager converts them
+def load_annotations(log_data, keyframes_list):
+    annotation_list = None
+    annotation_prompt = None
+    old_version = False
+    if log_data is not None:
+        try:
+            if 'history' in [k for k, v in log_data.items()]:
+                annotation_list = log_data['history']
+                old_version = True
+            else:
+                if 'Tracking_Annotation' in [k for k, v in log_data.items()]:
+                    annotation_list = log_data['Tracking_Annotation']
+                if 'Text_Annotation' in [k for k, v in log_data.items()]:
+                    annotation_prompt = log_data['Text_Annotation']
+        except:
+            pass
+
+    if annotation_list is None:
+        annotation_list = {}
+        for keyframe_index in keyframes_list:
+            annotation_list[str(keyframe_index)] = [None]
+
+    if annotation_prompt is None:
+        annotation_prompt = {}
+        for keyframe_index in keyframes_list:
+            annotation_prompt[str(keyframe_index)] = [None]
+
+    for k, v in annotation_list.items():
+        while len(annotation_prompt[k]) < len(annotation_list[k]):
+            annotation_prompt[k].append(None)
+    return annotation_list, annotation_prompt, old_version
+
+
 # Video management class
 class VideoManager:
-    def __init__(self, video_path, log_path):
-        # 读取标注信息
-        annotation_list = None
-        annotation_prompt = None
-        old_version = False
-        if os.path.exists(log_path):
+    def __init__(self, video_path, log_path, cache_size=frame_cache_size, origin_cache_size=origin_cache_size,
+                 decode_in_process=decode_in_process, proxy_path=None, use_disk_cache=use_disk_cache,
+                 compressed_cache_size=compressed_cache_size, crop_borders=crop_borders, prefetched=None,
+                 use_keyframe_store=False):
+        # 读取标注信息, a prefetched video (see VideoPrefetch.py) brings its log, opened frame source and first keyframes
+        log_data = load_log_data(log_path) if prefetched is None else prefetched['log_data']
+
+        # Get video frames from a video file or an image folder, the metadata is probed once and then read from the sidecar
+        if prefetched is not None:
+            source = prefetched['source']
+            meta = prefetched['meta']
+        else:
+            source = open_frame_source(video_path)
             try:
-                with open(log_path, 'r') as file:
-                    log_data = json.load(file)
-                if 'history' in [k for k, v in log_data.items()]:
-                    annotation_list = log_data['history']
-                    old_version = True
-                else:
-                    if 'Tracking_Annotation' in [k for k, v in log_data.items()]:
-                        annotation_list = log_data['Tracking_Annotation']
-                    if 'Text_Annotation' in [k for k, v in log_data.items()]:
-                        annotation_prompt = log_data['Text_Annotation']
-            except:
-                pass
-
-        # Get video frames
-        video = cv2.VideoCapture(video_path)
-        assert video is not None
-        video_fps = int(video.get(cv2.CAP_PROP_FPS))
-        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-
-        # Get len
-        video_len = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-        s = False
-        while not s:
-            video_len -= 1
-            video.set(cv2.CAP_PROP_POS_FRAMES, video_len)
-            s, _ = video.read()
-        video_len += 1
+                meta = source.probe(log_path)
+            except VideoOpenError:
+                source.release()
+                raise
+        # Kept fractional (e.g. 29.97), playback is paced by it against the wall clock
+        video_fps = float(meta['fps'])
+        height = meta['height']
+        width = meta['width']
+        video_len = meta['length']
+        try:
+            active_region = load_active_region(source, video_path, log_path) if crop_borders else None
+        except (OSError, cv2.error):
+            active_region = None
 
         # Get keyframes list
-        keyframes_list = []
-        for i in range(video_len):
-            if i % 30 == 0 or i == video_len - 1:
-                keyframes_list.append(i)
+        keyframes_list = get_keyframes_list(video_len)
 
         # Initialize annotation list
-        if annotation_list is None:
-            annotation_list = {}
-            for keyframe_index in keyframes_list:
-                annotation_list[str(keyframe_index)] = [None]
-
-        if annotation_prompt is None:
-            annotation_prompt = {}
-            for keyframe_index in keyframes_list:
-                annotation_prompt[str(keyframe_index)] = [None]
-
-        for k, v in annotation_list.items():
-            while len(annotation_prompt[k]) < len(annotation_list[k]):
-                annotation_prompt[k].append(None)
+        annotation_list, annotation_prompt, old_version = load_annotations(log_data, keyframes_list)
 
         # Calculate size scaling
         ori_size = [height, width]
@@ -134,21 +239,70 @@ class VideoManager:
             annotation_list = annotation_list_fix
 
         # Define class attributes
-        self.video = video
         self.fps = video_fps
         self.ori_size = ori_size
+        # Field of view (x, y, width, height) in original pixels, the display shows only this part of the frame
+        self.active_region = active_region
+        if active_region is not None:
+            scaling, scaling_size = self.get_display_scaling(show_context=True)
         self.scaling_size = scaling_size
         self.scaling = scaling
         self.scaling_ = scaling_
         self.scaling_fix = scaling
         self.video_len = video_len
         self.log_path = log_path
+        self.video_path = video_path
+        self.frame_cache = FrameCache(cache_size=cache_size)
+        self.origin_cache = FrameCache(cache_size=origin_cache_size)
+        if prefetched is not None:
+            for index, origin_frame in prefetched['frames'].items():
+                self.origin_cache.put(index, origin_frame)
+        # Display frames that fell out of frame_cache are still kept compressed, 0 disables it
+        self.compressed_cache = CompressedFrameCache(cache_size=compressed_cache_size) \
+            if compressed_cache_size > 0 else None
+        # Original-resolution frame of the last decode, shared with the close-ups of the same render
+        self.last_origin = (None, None)
+        # Base and original-resolution frame of the last rendered frame, annotation edits only redraw on top of them
+        self.held_frame = (None, None, None)
+        self.frame_ring = None
+        self.zoom_scale = 5
+        # Rendered close-up of the first annotated frame, per annotation point
+        self.begin_zoomin_cache = {}
+        if decode_in_process:
+            source.release()
+            self.reader = ProcessFrameReader(video_path, ori_size)
+        else:
+            self.reader = source
+        self.decode_in_process = decode_in_process
+        # Intra-frame proxy at display resolution, used for the display frames only. The close-ups keep
+        # reading the original video, and annotations stay in original-resolution pixels
+        self.proxy_candidate = None
+        self.proxy_path = None
+        self.proxy_reader = None
+        self.set_proxy(proxy_path)
+        # Number of source frames decoded, see Benchmark.py
+        self.decode_count = 0
+        # On-disk frame cache at the display size, filled in the background
+        self.disk_cache = None
+        self.disk_cache_filler = None
+        self.set_disk_cache(use_disk_cache)
+
+        # I-frame positions, built once per video in the background and stored in the sidecar
+        self.gop_keyframes = None
+        threading.Thread(target=self._load_gop_index, daemon=True).start()
 
         # Annotation information
         self.keyframes_list = keyframes_list
         self.annotation_list = annotation_list
         self.annotation_prompt = annotation_prompt
 
+        # Display-size keyframes and their previews, read once front to back in the background and
+        # saved, so keyframe jumps never seek. Only the interactive player uses it
+        self.use_keyframe_store = use_keyframe_store
+        self.keyframe_store = None
+        self.keyframe_store_builder = None
+        self.set_keyframe_store()
+
         # Location information
         self.selective_point = 0
         self.current_frame = 0
@@ -160,26 +314,73 @@ class VideoManager:
         self.show_annotation_index = True
         self.highlighted = True
 
-    def reset_scaling(self):
-        height = self.ori_size[0]
-        width = self.ori_size[1]
+    # Get the size of the displayed part of the frame in original pixels
+    def get_region_size(self):
+        if self.active_region is None:
+            return self.ori_size
+        return [self.active_region[3], self.active_region[2]]
+
+    # Get the display scale and size, the close-ups take a third of the screen width when the context is shown
+    def get_display_scaling(self, show_context):
+        region_height, region_width = self.get_region_size()
         screen = QGuiApplication.primaryScreen()
         screen_geometry = screen.availableGeometry()
         screen_width = screen_geometry.width()
         screen_height = screen_geometry.height()
-        if self.show_context:
-            scaling = min(screen_width / width / 1.5, screen_height * 1.0 / height) * 0.9
+        if show_context:
+            scaling = min(screen_width / region_width / 1.5, screen_height * 1.0 / region_height) * 0.9
         else:
-            scaling = min(screen_width * 1.0 / width, screen_height * 1.0 / height) * 0.9
-        height = int(height * scaling)
-        width = int(width * scaling)
-        scaling_size = [height, width]
-        scaling = height * 1.0 / self.ori_size[0]
+            scaling = min(screen_width * 1.0 / region_width, screen_height * 1.0 / region_height) * 0.9
+        height = int(region_height * scaling)
+        width = int(region_width * scaling)
+        return height * 1.0 / region_height, [height, width]
+
+    def reset_scaling(self):
+        scaling, scaling_size = self.get_display_scaling(self.show_context)
         self.scaling = scaling
         self.scaling_size = scaling_size
         self.scaling_fix = scaling
+        # Cached frames were resized to the old display size
+        self.frame_cache.clear()
+        if self.compressed_cache is not None:
+            self.compressed_cache.clear()
+        self.held_frame = (None, None, None)
+        self._open_proxy()
+        if self.disk_cache is not None:
+            self.set_disk_cache(True)
+        self.set_keyframe_store()
 
     # Input
+    def set_cache_size(self, cache_size):
+        self.frame_cache.set_budget(cache_size)
+
+    # Switch between the whole frame and its detected active region
+    def set_crop_borders(self, enabled):
+        active_region = None
+        if enabled:
+            source = open_frame_source(self.video_path)
+            try:
+                active_region = load_active_region(source, self.video_path, self.log_path)
+            finally:
+                source.release()
+        if active_region != self.active_region:
+            self.active_region = active_region
+            self.reset_scaling()
+
+    # Cut the active region out of a source frame, a view is returned
+    def crop_frame(self, frame):
+        return crop_active_region(frame, self.active_region, self.ori_size)
+
+    # Attach the ring buffer filled by a read-ahead decoder
+    def set_frame_ring(self, frame_ring):
+        self.frame_ring = frame_ring
+
+    def set_zoom_scale(self, zoom_scale):
+        self.zoom_scale = zoom_scale
+
+    def get_zoom_scale(self):
+        return self.zoom_scale
+
     def set_show_label(self, show_label: bool):
         self.show_label = show_label
 
@@ -198,7 +399,18 @@ class VideoManager:
     def set_highlighted(self, highlighted: bool):
         self.highlighted = highlighted
 
+    # Drop cached begin close-ups that show a frame which is being edited.
+    # Inserting or deleting points shifts the point indices, so every cached close-up of that frame is dropped
+    def invalidate_begin_zoomin(self, frame_index, shifted=False):
+        frame_index = int(frame_index)
+        if shifted and frame_index in [v[0] for v in self.begin_zoomin_cache.values()]:
+            self.begin_zoomin_cache.clear()
+            return
+        for annotation_index in [k for k, v in self.begin_zoomin_cache.items() if v[0] == frame_index]:
+            self.begin_zoomin_cache.pop(annotation_index)
+
     def annotation_insert(self, frame_index, annotation_index):
+        self.invalidate_begin_zoomin(frame_index, shifted=True)
         annotation = self.annotation_list[str(frame_index)]
         annotation.insert(annotation_index, None)
         self.annotation_list[str(frame_index)] = annotation
@@ -207,6 +419,7 @@ class VideoManager:
         self.annotation_prompt[str(frame_index)] = annotation
 
     def annotation_append(self, frame_index):
+        self.invalidate_begin_zoomin(frame_index)
         annotation = self.annotation_list[str(frame_index)]
         annotation.append(None)
         self.annotation_list[str(frame_index)] = annotation
@@ -215,6 +428,7 @@ class VideoManager:
         self.annotation_prompt[str(frame_index)] = annotation
 
     def annotation_delete(self, frame_index, annotation_index):
+        self.invalidate_begin_zoomin(frame_index, shifted=True)
         annotation = self.annotation_list[str(frame_index)]
         annotation.pop(annotation_index)
         self.annotation_list[str(frame_index)] = annotation
@@ -223,8 +437,10 @@ class VideoManager:
         self.annotation_prompt[str(frame_index)] = annotation
 
     def set_annotation(self, frame_index, annotation_index, point):
+        self.invalidate_begin_zoomin(frame_index)
         annotation = self.annotation_list[str(frame_index)]
-        annotation[annotation_index] = (point[0] // self.scaling, point[1] // self.scaling)
+        x_offset, y_offset = (0, 0) if self.active_region is None else self.active_region[:2]
+        annotation[annotation_index] = (point[0] // self.scaling + x_offset, point[1] // self.scaling + y_offset)
         self.annotation_list[str(frame_index)] = annotation
 
     def set_prompt_annotation(self, frame_index, annotation_index, annotation):
@@ -235,6 +451,7 @@ class VideoManager:
         self.annotation_prompt[str(frame_index)] = annotations
 
     def auto_fill(self, frame_index, auto_fill_setting):
+        self.invalidate_begin_zoomin(frame_index)
         if auto_fill_setting == 'From first frame':
             self.annotation_list[str(frame_index)] = copy.deepcopy(self.annotation_list['0'])
             self.annotation_prompt[str(frame_index)] = copy.deepcopy(self.annotation_prompt['0'])
@@ -247,6 +464,7 @@ class VideoManager:
         keyframe_list = self.keyframes_list
         if frame_index not in keyframe_list or frame_index == 0:
             return []
+        self.invalidate_begin_zoomin(frame_index, shifted=True)
         point_annotation_list = self.annotation_list
         prompt_annotation_list = self.annotation_prompt
         changed_list = []
@@ -335,10 +553,12 @@ class VideoManager:
         x_fix = clamp(x_fix, 0, self.ori_size[1] - 1)
         y_fix = clamp(y_fix, 0, self.ori_size[0] - 1)
         if x != x_fix or y != y_fix:
+            self.invalidate_begin_zoomin(frame_index)
             point_fix = [x_fix, y_fix]
             self.annotation_list[str(frame_index)][annotation_index] = point_fix
 
     def cancel_annotation(self, frame_index, annotation_index):
+        self.invalidate_begin_zoomin(frame_index)
         annotation = self.annotation_list[str(frame_index)]
         annotation[annotation_index] = None
         self.annotation_list[str(frame_index)] = annotation
@@ -366,6 +586,28 @@ class VideoManager:
     def get_keyframe_list(self):
         return self.keyframes_list
 
+    def get_cache_stats(self):
+        return self.frame_cache.get_stats()
+
+    def get_compressed_cache_stats(self):
+        return None if self.compressed_cache is None else self.compressed_cache.get_stats()
+
+    # Whether the base frame of a frame is held from the last render
+    def is_held(self, index):
+        return self.held_frame[0] == index
+
+    # Whether a frame can be displayed without decoding it
+    def is_decoded(self, index):
+        if self.is_held(index) or index in self.frame_cache:
+            return True
+        if self.compressed_cache is not None and index in self.compressed_cache:
+            return True
+        if self.keyframe_store is not None and index in self.keyframe_store:
+            return True
+        if self.disk_cache is not None and index in self.disk_cache:
+            return True
+        return self.frame_ring is not None and index in self.frame_ring
+
     # Get len
     def __len__(self):
         return self.video_len
@@ -374,57 +616,204 @@ class VideoManager:
     def get_black_frame(self):
         return np.zeros((self.scaling_size[0], self.scaling_size[1], 3), dtype=np.uint8)
 
+    def get_decode_stats(self):
+        return self.reader.get_stats()
+
+    # Release the frame source, or stop the decoder process
+    def release(self):
+        self.stop_keyframe_store()
+        self.set_disk_cache(False)
+        if self.compressed_cache is not None:
+            self.compressed_cache.release()
+        self.reader.release()
+        self.set_proxy(None)
+
+    # Open the on-disk frame cache of the current display size and fill it in the background. It is keyed by the
+    # original video and always filled from it, never from the proxy
+    def set_disk_cache(self, enabled):
+        if self.disk_cache_filler is not None:
+            self.disk_cache_filler.stop()
+            self.disk_cache_filler = None
+        if self.disk_cache is not None:
+            self.disk_cache.release()
+            self.disk_cache = None
+        if not enabled:
+            return
+        self.disk_cache = open_disk_cache(self.video_path, self.video_len, self.scaling_size, self.active_region)
+        if self.disk_cache is not None:
+            self.disk_cache_filler = DiskCacheFiller(self.disk_cache, self.video_path, self.video_len,
+                                                     crop=self.crop_frame)
+            self.disk_cache_filler.start()
+
+    # Open the keyframe store of the current display size and fill in the missing keyframes
+    def set_keyframe_store(self):
+        self.stop_keyframe_store()
+        if not self.use_keyframe_store:
+            return
+        self.keyframe_store = open_keyframe_store(self.video_path, self.scaling_size, self.active_region)
+        if self.keyframe_store is not None:
+            # Read from the original, the store is keyed by it
+            self.keyframe_store_builder = KeyframeStoreBuilder(self.keyframe_store, self.video_path,
+                                                               self.keyframes_list, self.scaling_size,
+                                                               crop=self.crop_frame)
+            self.keyframe_store_builder.start()
+
+    def stop_keyframe_store(self):
+        if self.keyframe_store_builder is not None:
+            self.keyframe_store_builder.stop()
+            self.keyframe_store_builder = None
+
+    # Get the preview of a keyframe for the marker bar and scrubbing, None until the keyframe store has it
+    def get_keyframe_thumbnail(self, index):
+        return None if self.keyframe_store is None else self.keyframe_store.get_thumbnail(index)
+
+    def get_disk_cache_stats(self):
+        return None if self.disk_cache is None else self.disk_cache.get_stats()
+
+    # Switch the display frames to a proxy video, it is ignored unless it has the frames of the source
+    def set_proxy(self, proxy_path):
+        self.proxy_candidate = proxy_path
+        self._open_proxy()
+
+    # Open the proxy if it is sharp enough for the current display size: a proxy shorter than the source
+    # pixels shown would be upscaled. It is reopened whenever the display size changes
+    def _open_proxy(self):
+        if self.proxy_reader is not None:
+            self.proxy_reader.release()
+        self.proxy_path = self.proxy_reader = None
+        if self.proxy_candidate is None:
+            return
+        try:
+            proxy_reader = open_frame_source(self.proxy_candidate)
+        except VideoOpenError:
+            return
+        needed_height = min(self.scaling_size[0] * self.ori_size[0] / self.get_region_size()[0], self.ori_size[0])
+        if len(proxy_reader) != self.video_len or proxy_reader.height < int(needed_height):
+            proxy_reader.release()
+            return
+        self.proxy_path = self.proxy_candidate
+        self.proxy_reader = proxy_reader
+
+    # Path of the video the display frames are decoded from
+    def get_display_path(self):
+        return self.video_path if self.proxy_path is None else self.proxy_path
+
+    def get_gop_keyframes(self):
+        return self.gop_keyframes
+
+    def _load_gop_index(self):
+        gop_index = load_gop_index(self.video_path, self.log_path)
+        self.gop_keyframes = gop_index['keyframes'] or None
+        self.reader.set_gop_keyframes(self.gop_keyframes)
+
     # Get original frame
     def get_origin_frame(self, index):
-        self.video.set(cv2.CAP_PROP_POS_FRAMES, index)
-        _, frame = self.video.read()
+        self.decode_count += 1
+        frame = self.reader.read(index)
         assert frame is not None
         return frame
 
-    # Get pure frame
-    def get_pure_frame(self, index):
-        frame = self.get_origin_frame(index)
-        frame = cv2.resize(frame, (self.scaling_size[1], self.scaling_size[0]))
-        return frame
-
-    # Get labeled frame
-    def get_labeled_frame(self, index, only_inner_circle=False):
-        # 判断是否为标注帧
-        is_keyframe = index in self.keyframes_list
-        if not is_keyframe:
-            return self.get_pure_frame(index)
-        # 标注帧
-        frame = self.get_pure_frame(index)
-        try:
-            annotation = self.annotation_list[str(index)]
-        except:
-            return frame
-        scaling = self.scaling
-        for pt in annotation:
-            if pt is not None:
-                pt = (int(pt[0] * scaling), int(pt[1] * scaling))
-                cv2.circle(frame, pt, 3, point_color, 1)
-                if not only_inner_circle:
-                    cv2.circle(frame, pt, 8, point_color, 2)
+    # Get the decoded and resized frame shared by one render, it must not be drawn on
+    def get_base_frame(self, index):
+        if self.held_frame[0] == index:
+            return self.held_frame[1]
+        frame = self.frame_cache.get(index)
+        if frame is None and self.frame_ring is not None:
+            frame = self.frame_ring.get(index)
+            if frame is not None:
+                self._cache_frame(index, frame)
+                origin_frame = self.frame_ring.get_origin(index)
+                if origin_frame is not None:
+                    self.origin_cache.put(index, origin_frame)
+                # The ring reads the proxy while there is one, only frames of the original go to the disk cache
+                if self.disk_cache is not None and self.proxy_path is None:
+                    self.disk_cache.put(index, frame)
+        if frame is None and self.disk_cache is not None:
+            frame = self.disk_cache.get(index)
+        if frame is None and self.keyframe_store is not None and index in self.keyframe_store:
+            frame = self.keyframe_store.get_frame(index)
+            if frame is not None:
+                self.frame_cache.put(index, frame)
+        if frame is None and self.compressed_cache is not None:
+            frame = self.compressed_cache.get(index)
+            if frame is not None:
+                self.frame_cache.put(index, frame)
+        if frame is None and self.proxy_reader is not None:
+            frame = self.proxy_reader.read(index)
+            if frame is not None:
+                self.decode_count += 1
+                frame = cv2.resize(self.crop_frame(frame), (self.scaling_size[1], self.scaling_size[0]))
+                self._cache_frame(index, frame)
+        if frame is None:
+            origin_frame = self.origin_cache.get(index)
+            if origin_frame is None:
+                origin_frame = self.get_origin_frame(index)
+            self.last_origin = (index, origin_frame)
+            if index in self.keyframes_list:
+                self.origin_cache.put(index, origin_frame)
+            frame = cv2.resize(self.crop_frame(origin_frame), (self.scaling_size[1], self.scaling_size[0]))
+            self._cache_frame(index, frame)
+            if self.disk_cache is not None:
+                self.disk_cache.put(index, frame)
         return frame
 
-    # Get highlighted frame
-    def get_highlighted_labeled_frame(self, frame_index, annotation_index, only_inner_circle=False, inner_size=4):
+    # Keep a decoded display frame in the raw cache, and compressed for when it falls out of the raw cache
+    def _cache_frame(self, index, frame):
+        self.frame_cache.put(index, frame)
+        if self.compressed_cache is not None and self.disk_cache is None:
+            self.compressed_cache.put(index, frame)
 
-        is_keyframe = frame_index in self.keyframes_list
-        if not is_keyframe:
-            return self.get_pure_frame(frame_index)
+    # Get the keyframe preview nearest to a frame, from the keyframe store
+    def get_preview_frame(self, index):
+        if self.keyframe_store is None:
+            return None
+        keyframes_list = self.keyframes_list
+        position = bisect.bisect_left(keyframes_list, index)
+        before, after = position - 1, position
+        while before >= 0 or after < len(keyframes_list):
+            if after >= len(keyframes_list) or \
+                    (before >= 0 and index - keyframes_list[before] <= keyframes_list[after] - index):
+                keyframe_index = keyframes_list[before]
+                before -= 1
+            else:
+                keyframe_index = keyframes_list[after]
+                after += 1
+            preview = self.get_keyframe_thumbnail(keyframe_index)
+            if preview is not None:
+                return preview
+        return None
+
+    # Get an original-resolution frame for the close-ups, decoded only if no render holds it
+    def get_loupe_frame(self, index):
+        if self.held_frame[0] == index and self.held_frame[2] is not None:
+            return self.held_frame[2]
+        if self.last_origin[0] == index:
+            return self.last_origin[1]
+        origin_frame = self.origin_cache.get(index)
+        if origin_frame is None and self.frame_ring is not None:
+            origin_frame = self.frame_ring.get_origin(index)
+        if origin_frame is None:
+            origin_frame = self.get_origin_frame(index)
+            self.last_origin = (index, origin_frame)
+        self.origin_cache.put(index, origin_frame)
+        return origin_frame
+
+    # Get pure frame, read through the frame cache. A copy is returned since callers draw on it
+    def get_pure_frame(self, index):
+        return self.get_base_frame(index).copy()
 
-        frame = self.get_pure_frame(frame_index)
+    # Draw the annotation points of a keyframe
+    def draw_annotation(self, frame, frame_index, annotation_index=None, only_inner_circle=False, inner_size=4):
         try:
             annotation = self.annotation_list[str(frame_index)]
         except:
             return frame
         scaling = self.scaling
+        x_offset, y_offset = (0, 0) if self.active_region is None else self.active_region[:2]
         for index, pt in enumerate(annotation):
             if pt is not None:
-                pt = (int(pt[0] * scaling), int(pt[1] * scaling))
-                if index == annotation_index:
+                pt = (int((pt[0] - x_offset) * scaling), int((pt[1] - y_offset) * scaling))
+                if annotation_index is not None and index == annotation_index:
                     cv2.circle(frame, pt, inner_size, highlight_color, 1)
                     if not only_inner_circle:
                         cv2.circle(frame, pt, 10, highlight_color, 2)
@@ -434,49 +823,69 @@ class VideoManager:
                         cv2.circle(frame, pt, 8, point_color, 2)
         return frame
 
-    # Get zoomin frame
-    def get_zoomin_frame(self, frame_index, annotation_index, zoom_scale=5):
+    # Get labeled frame
+    def get_labeled_frame(self, index, only_inner_circle=False):
+        frame = self.get_pure_frame(index)
+        # 判断是否为标注帧
+        if index in self.keyframes_list:
+            self.draw_annotation(frame, index, only_inner_circle=only_inner_circle)
+        return frame
 
-        is_keyframe = frame_index in self.keyframes_list
-        if not is_keyframe:
-            return self.get_black_frame()
+    # Get highlighted frame
+    def get_highlighted_labeled_frame(self, frame_index, annotation_index, only_inner_circle=False, inner_size=4):
+        frame = self.get_pure_frame(frame_index)
+        if frame_index in self.keyframes_list:
+            self.draw_annotation(frame, frame_index, annotation_index, only_inner_circle, inner_size)
+        return frame
 
-        scaling = self.scaling
-        frame = self.get_highlighted_labeled_frame(frame_index, annotation_index, only_inner_circle=True, inner_size=2)
+    # Get zoomin frame
+    def get_zoomin_frame(self, frame_index, annotation_index, zoom_scale=None):
+        frame = self.get_black_frame()
+        self.render_zoomin_frame(frame, frame_index, annotation_index, zoom_scale)
+        return frame
+
+    # Get the annotation point shown in a close-up, None if there is nothing to show
+    def get_zoomin_point(self, frame_index, annotation_index):
+        if frame_index not in self.keyframes_list:
+            return None
         try:
-            annotation = self.annotation_list[str(frame_index)][annotation_index]
+            return self.annotation_list[str(frame_index)][annotation_index]
         except:
-            return self.get_black_frame()
+            return None
+
+    # Render the close-up of an annotation point into dst. The region of interest is cropped from the
+    # original-resolution frame and only the crop is resized, straight into dst
+    def render_zoomin_frame(self, dst, frame_index, annotation_index, zoom_scale=None):
+        annotation = self.get_zoomin_point(frame_index, annotation_index)
         if annotation is None:
-            return self.get_black_frame()
-        annotation_fix = (int(annotation[0] * scaling), int(annotation[1] * scaling))
-        # Calculate the clipping size
-        append_height = int(1.0 * self.scaling_size[0] / zoom_scale / 2)
-        append_width = int(1.0 * self.scaling_size[1] / zoom_scale / 2)
-        # Determine the cropping position
-        x_left = annotation_fix[0] - append_width
-        x_right = annotation_fix[0] + append_width + 1
-        y_up = annotation_fix[1] - append_height
-        y_down = annotation_fix[1] + append_height + 1
-        # Correct the clipping position
-        if x_left < 0:
-            x_right -= x_left
-            x_left = 0
-        if x_right > self.scaling_size[1]:
-            fix = x_right - self.scaling_size[1]
-            x_left -= fix
-            x_right -= fix
-        if y_up < 0:
-            y_down -= y_up
-            y_up = 0
-        if y_down > self.scaling_size[0]:
-            fix = y_down - self.scaling_size[0]
-            y_up -= fix
-            y_down -= fix
-        # Crop picture
-        crop_frame = frame[y_up:y_down, x_left:x_right]
-        crop_frame = cv2.resize(crop_frame, (self.scaling_size[1], self.scaling_size[0]))
-        return crop_frame
+            dst.fill(0)
+            return dst
+        origin_frame = self.get_loupe_frame(frame_index)
+        if zoom_scale is None:
+            zoom_scale = self.zoom_scale
+        height, width = self.scaling_size
+        ori_height, ori_width = origin_frame.shape[:2]
+        # Calculate the clipping size in original pixels
+        crop_height = min(max(int(round(height / self.scaling / zoom_scale)), 1), ori_height)
+        crop_width = min(max(int(round(width / self.scaling / zoom_scale)), 1), ori_width)
+        # Determine the cropping position, keeping the window inside the frame
+        x_left = min(max(int(annotation[0]) - crop_width // 2, 0), ori_width - crop_width)
+        y_up = min(max(int(annotation[1]) - crop_height // 2, 0), ori_height - crop_height)
+        crop_frame = origin_frame[y_up:y_up + crop_height, x_left:x_left + crop_width]
+        cv2.resize(crop_frame, (dst.shape[1], dst.shape[0]), dst=dst, interpolation=cv2.INTER_CUBIC)
+        # Draw the points at close-up resolution, centered on their original pixel
+        scale_x = 1.0 * dst.shape[1] / crop_width
+        scale_y = 1.0 * dst.shape[0] / crop_height
+        radius = max(int(zoom_scale * dst.shape[0] / height), 2)
+        for index, pt in enumerate(self.annotation_list[str(frame_index)]):
+            if pt is None:
+                continue
+            pt = (int((pt[0] - x_left + 0.5) * scale_x), int((pt[1] - y_up + 0.5) * scale_y))
+            if index == annotation_index:
+                cv2.circle(dst, pt, 2 * radius, highlight_color, 2)
+            else:
+                cv2.circle(dst, pt, 3 * radius, point_color, 2)
+        return dst
 
     # Get the initial frame of the marker
     def get_begin_frame_index(self, annotation_index):
@@ -491,55 +900,82 @@ class VideoManager:
                 continue
         return frame_index
 
+    # Render the close-up of the first valid annotation frame into dst, cached until that frame is edited
+    def render_begin_zoomin_frame(self, dst, annotation_index):
+        frame_beg_index = self.get_begin_frame_index(annotation_index=annotation_index)
+        if frame_beg_index is None:
+            dst.fill(0)
+            return dst
+        key = (frame_beg_index, self.zoom_scale, dst.shape)
+        cached = self.begin_zoomin_cache.get(annotation_index)
+        if cached is not None and cached[:3] == key:
+            np.copyto(dst, cached[3])
+            return dst
+        self.render_zoomin_frame(dst, frame_beg_index, annotation_index)
+        self.begin_zoomin_cache[annotation_index] = key + (dst.copy(),)
+        return dst
+
+    # Get the shape of a rendered frame, the close-ups take a column of half the width
+    def get_canvas_shape(self):
+        height, width = self.scaling_size
+        if self.show_label and self.show_context:
+            width += width // 2
+        return height, width, 3
+
     # Get display updates, where index should be a tuple of length 2
     def __getitem__(self, index):
-        frame_index = index[0]
+        canvas = np.empty(self.get_canvas_shape(), dtype=np.uint8)
+        return self.render(index[0], index[1], canvas)
+
+    # Draw the nearest keyframe preview upscaled into the main view, False if there is none yet
+    def render_preview(self, frame_index, canvas):
+        preview = self.get_preview_frame(frame_index)
+        if preview is None:
+            return False
+        height, width = self.scaling_size
+        frame = canvas[:, :width]
+        cv2.resize(preview, (width, height), dst=frame, interpolation=cv2.INTER_LINEAR)
+        if self.show_frame_index:
+            cv2.putText(frame, str(frame_index), (0 + 20, 0 + 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        return True
+
+    # Render a frame into a preallocated canvas of get_canvas_shape(). Every source frame is decoded and
+    # resized once, overlays are drawn in place and the close-ups are resized straight into the canvas
+    def render(self, frame_index, annotation_index, canvas):
         if frame_index < 0:
             frame_index += len(self)
-        annotation_index = index[1]
         # Determine whether it is a marked frame
         is_keyframe = (frame_index in self.keyframes_list)
+        base_frame = self.get_base_frame(frame_index)
+        if self.held_frame[0] != frame_index:
+            self.held_frame = (frame_index, base_frame, None)
+        height, width = self.scaling_size
+        frame = canvas[:, :width]
+        np.copyto(frame, base_frame)
         if not self.show_label:
-            frame = self.get_pure_frame(frame_index)
             if self.show_frame_index:
-                frame = cv2.putText(frame, str(frame_index), (0 + 20, 0 + 40), cv2.FONT_HERSHEY_SIMPLEX,
-                                    1, (0, 0, 255), 2)
-        elif self.show_context:
-            # Get main screen
+                cv2.putText(frame, str(frame_index), (0 + 20, 0 + 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            return canvas
+        # Get main screen
+        if is_keyframe:
             if self.highlighted:
-                frame_main = self.get_highlighted_labeled_frame(frame_index=frame_index,
-                                                                annotation_index=annotation_index)
-            else:
-                frame_main = self.get_labeled_frame(frame_index)
-            if self.show_frame_index:
-                frame_main = cv2.putText(frame_main, str(frame_index), (0 + 20, 0 + 40), cv2.FONT_HERSHEY_SIMPLEX,
-                                         1, (0, 0, 255), 2)
-            if self.show_annotation_index and is_keyframe:
-                frame_main = cv2.putText(frame_main, str(annotation_index), (0 + 20, self.scaling_size[0] - 20),
-                                         cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            # Get the first valid annotation frame
-            frame_beg_index = self.get_begin_frame_index(annotation_index=annotation_index)
-            if frame_beg_index is not None:
-                frame_beg = self.get_zoomin_frame(frame_index=frame_beg_index, annotation_index=annotation_index)
+                self.draw_annotation(frame, frame_index, annotation_index)
             else:
-                frame_beg = self.get_black_frame()
-            # Get the current frame annotation information
-            frame_now = self.get_zoomin_frame(frame_index=frame_index, annotation_index=annotation_index)
-            concat_frame = cv2.vconcat([frame_beg, frame_now])
-            concat_frame = cv2.resize(concat_frame, (self.scaling_size[1] // 2, self.scaling_size[0]))
-            frame = cv2.hconcat([frame_main, concat_frame])
-        else:
-            if self.highlighted:
-                frame = self.get_highlighted_labeled_frame(frame_index=frame_index, annotation_index=annotation_index)
-            else:
-                frame = self.get_labeled_frame(index=frame_index)
-            if self.show_frame_index:
-                frame = cv2.putText(frame, str(frame_index), (0 + 20, 0 + 40), cv2.FONT_HERSHEY_SIMPLEX,
-                                    1, (0, 0, 255), 2)
-            if self.show_annotation_index:
-                frame = cv2.putText(frame, str(annotation_index), (0 + 20, self.scaling_size[0] - 20),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        return frame
+                self.draw_annotation(frame, frame_index)
+        if self.show_frame_index:
+            cv2.putText(frame, str(frame_index), (0 + 20, 0 + 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        if self.show_annotation_index and (is_keyframe or not self.show_context):
+            cv2.putText(frame, str(annotation_index), (0 + 20, height - 20), cv2.FONT_HERSHEY_SIMPLEX,
+                        1, (0, 255, 0), 2)
+        if not self.show_context:
+            return canvas
+        # Get the current frame annotation information, before anything else is decoded
+        self.render_zoomin_frame(canvas[height // 2:, width:], frame_index, annotation_index)
+        if is_keyframe and self.held_frame[2] is None:
+            self.held_frame = (frame_index, base_frame, self.get_loupe_frame(frame_index))
+        # Get the first valid annotation frame
+        self.render_begin_zoomin_frame(canvas[:height // 2, width:], annotation_index)
+        return canvas
 
 
 # Video playback class
@@ -562,13 +998,29 @@ class VideoFramePlayer(QWidget):
         self.current_frame = 0
         self.current_annotation = 0
         self.auto_fill_setting = 'From previous frame'
+        self.cache_size = frame_cache_size
+        self.decoder = None
+        self.read_ahead = read_ahead_size
+        # Decode the display frames from proxy videos once they are built
+        self.use_proxy = False
+        self.use_disk_cache = use_disk_cache
+        self.crop_borders = crop_borders
+        # Slider drags only show previews, the frame is switched when the slider is released.
+        # Without a decoder thread the newest frame is decoded once the event queue is drained
+        self.scrubbing = False
+        self.scrub_origin = 0
+        self.scrub_timer = QTimer(self)
+        self.scrub_timer.setSingleShot(True)
+        self.scrub_timer.setInterval(0)
+        self.scrub_timer.timeout.connect(self._scrub_render)
 
         self.FrameSwitch.connect(self.switch_by_mouse)
         self.KeyFrameSwitch.connect(self.switch_by_mouse)
 
-        # Define timer
-        self.timer = QTimer()
-        self.timer.timeout.connect(self._next_frame)
+        # Define the playback engine
+        self.playback = PlaybackEngine(self)
+        self.playback.FrameDue.connect(self._play_frame)
+        self.playback.Finished.connect(self.pause_play)
 
         # Initialize video box
         self.monitor = LabelingWidget()
@@ -579,14 +1031,20 @@ class VideoFramePlayer(QWidget):
         # self.label.setPixmap(pixmap)
 
         self.videoPlayBar = VideoPlayBar(self)
-        self.keyframeIndicator = MarkerOverlay(self, jump_callback=self._switch_by_marker)
+        self.videoPlayBar.set_speed_list(playback_speeds, 1.0)
+        self.playback.FpsMeasured.connect(self.videoPlayBar.set_fps_info)
+        self.keyframeIndicator = MarkerOverlay(self, jump_callback=self._switch_by_marker,
+                                               thumbnail_callback=self._get_marker_thumbnail)
 
         # Defining signals and slots
         self.videoPlayBar.playBtn.clicked.connect(self._toggle_play)
         self.videoPlayBar.progressSlider.valueChanged.connect(self.check_button)
         self.videoPlayBar.progressSlider.valueChanged.connect(self._switch_by_slider)
+        self.videoPlayBar.progressSlider.sliderPressed.connect(self._scrub_started)
+        self.videoPlayBar.progressSlider.sliderReleased.connect(self._scrub_finished)
         self.videoPlayBar.preBtn.clicked.connect(self._switch_backward)
         self.videoPlayBar.nextBtn.clicked.connect(self._switch_forward)
+        self.videoPlayBar.speedBox.currentIndexChanged.connect(self._speed_changed)
         self.monitor.Labeled.connect(self._label_at)
         self.monitor.Canceled.connect(self._label_cancel)
         self.monitor.AutoFilled.connect(self._label_auto_filled)
@@ -606,6 +1064,10 @@ class VideoFramePlayer(QWidget):
 
         self.setLayout(self.mainLayout)
 
+        app = QApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.release_video)
+
     # Reinitialize the form
     def reinit(self):
         self.pause_play()
@@ -633,6 +1095,12 @@ class VideoFramePlayer(QWidget):
     def wheelEvent(self, event):
         delta = event.angleDelta().y()
         modifiers = event.modifiers()
+        # Alt + wheel zooms the close-ups, some platforms report it as a horizontal wheel
+        if modifiers == Qt.KeyboardModifier.AltModifier:
+            delta = delta or event.angleDelta().x()
+            if delta:
+                self.switch_zoom(delta > 0)
+            return
         # Roll up
         if delta > 0:
             if modifiers == Qt.KeyboardModifier.NoModifier:
@@ -660,26 +1128,49 @@ class VideoFramePlayer(QWidget):
 
     def set_current_annotation(self, index):
         self.current_annotation = index
-        self.update_frame()
+        self.update_overlay()
 
     def get_prompt_annotation(self, frame_index, annotation_index):
         return self.video.get_prompt_annotation(frame_index=frame_index, annotation_index=annotation_index)
 
     # Set the video that is currently playing in the form
-    def load_video(self, video_path, log_path):
-        self.video = VideoManager(video_path=video_path, log_path=log_path)
+    def load_video(self, video_path, log_path, prefetched=None):
+        self.release_video()
+        try:
+            self.video = VideoManager(video_path=video_path, log_path=log_path, cache_size=self.cache_size,
+                                      proxy_path=find_proxy(video_path) if self.use_proxy else None,
+                                      use_disk_cache=self.use_disk_cache, crop_borders=self.crop_borders,
+                                      prefetched=prefetched, use_keyframe_store=True)
+        except VideoOpenError:
+            self.unload_video()
+            raise
+        self.start_decoder()
         self.videoPlayBar.set_frames_num(len(self) - 1)
         self.keyframeIndicator.remake(keyframe_list=self.video.get_keyframe_list(),
                                       progress_bar_len=self.videoPlayBar.get_slider_width())
         self.reinit()
         self.update_frame()
 
+    # Drop the current video, so that nothing is saved into the log of a video that failed to load
+    def unload_video(self):
+        self.release_video()
+        self.pause_play()
+        self.video = None
+        self.monitor.clear()
+
     # Set video playback format
     def set_show_label(self, show_label: bool):
         self.video.set_show_label(show_label)
 
     def set_show_context(self, show_context: bool):
+        proxy_path = self.video.proxy_path
         self.video.set_show_context(show_context)
+        # The proxy is dropped or taken back when the display size no longer suits it
+        if self.video.proxy_path != proxy_path:
+            self.stop_decoder()
+            self.start_decoder()
+        elif self.decoder is not None:
+            self.decoder.set_scaling_size(self.video.scaling_size)
 
     def set_show_frame_index(self, show_frame_index: bool):
         self.video.set_show_frame_index(show_frame_index)
@@ -690,11 +1181,17 @@ class VideoFramePlayer(QWidget):
     def set_highlighted(self, highlighted: bool):
         self.video.set_highlighted(highlighted)
 
+    # Set the memory budget (MB) of the decoded frame cache
+    def set_cache_size(self, cache_size):
+        self.cache_size = cache_size
+        if self.video is not None:
+            self.video.set_cache_size(cache_size)
+
     def set_video_format(self, show_label: bool, show_context: bool, show_frame_index: bool,
                          show_annotation_index: bool, highlighted: bool):
         if self.video is not None:
             self.video.set_show_label(show_label)
-            self.video.set_show_context(show_context)
+            self.set_show_context(show_context)
             self.video.set_show_frame_index(show_frame_index)
             self.video.set_show_annotation_index(show_annotation_index)
             self.video.set_highlighted(highlighted)
@@ -722,22 +1219,113 @@ class VideoFramePlayer(QWidget):
             return
         self.videoPlayBar.set_frames_progress(self.current_frame)
 
-    # Set playback frame
+    # Start the read-ahead decoder of the current video, it reads the proxy when there is one
+    def start_decoder(self):
+        if self.read_ahead <= 0:
+            return
+        use_proxy = self.video.proxy_path is not None
+        self.decoder = ReadAheadDecoder(video_path=self.video.get_display_path(), video_len=len(self.video),
+                                        scaling_size=self.video.scaling_size, read_ahead=self.read_ahead,
+                                        get_gop_keyframes=None if use_proxy else self.video.get_gop_keyframes,
+                                        keyframes_list=self.video.get_keyframe_list(),
+                                        reader=self.video.reader if self.video.decode_in_process and not use_proxy
+                                        else None,
+                                        keep_origin=not use_proxy, crop=self.video.crop_frame)
+        self.decoder.FrameDecoded.connect(self._frame_decoded)
+        self.video.set_frame_ring(self.decoder.ring)
+        self.decoder.start()
+
+    def set_use_disk_cache(self, use_disk_cache: bool):
+        self.use_disk_cache = use_disk_cache
+        if self.video is not None and (self.video.disk_cache is not None) != use_disk_cache:
+            self.video.set_disk_cache(use_disk_cache)
+
+    def set_crop_borders(self, crop_borders: bool):
+        if crop_borders == self.crop_borders:
+            return
+        self.crop_borders = crop_borders
+        if self.video is None:
+            return
+        self.stop_decoder()
+        # The video is shown uncropped when its field of view cannot be detected
+        try:
+            self.video.set_crop_borders(crop_borders)
+        except (VideoOpenError, OSError, cv2.error):
+            pass
+        self.start_decoder()
+        self.update_frame()
+
+    def set_use_proxy(self, use_proxy: bool):
+        self.use_proxy = use_proxy
+        if self.video is not None:
+            self.attach_proxy(self.video.video_path, find_proxy(self.video.video_path) if use_proxy else None)
+
+    # Proxy builder slot function, switch the current video to its proxy once it is built
+    def attach_proxy(self, video_path, proxy_path):
+        if self.video is None or self.video.video_path != video_path or proxy_path == self.video.proxy_path:
+            return
+        if proxy_path is not None and not self.use_proxy:
+            return
+        self.stop_decoder()
+        self.video.set_proxy(proxy_path)
+        self.start_decoder()
+        self.update_frame()
+
+    # Stop the read-ahead decoder of the current video
+    def stop_decoder(self):
+        if self.decoder is not None:
+            self.decoder.FrameDecoded.disconnect(self._frame_decoded)
+            self.decoder.stop()
+            self.decoder = None
+            if self.video is not None:
+                self.video.set_frame_ring(None)
+
+    # Stop the decoder and release the current video
+    def release_video(self):
+        self.stop_decoder()
+        if self.video is not None:
+            self.video.release()
+            self.video = None
+
+    # Decoder slot function, draw the current frame once it is decoded
+    def _frame_decoded(self, index):
+        if self.video is not None and index == self.current_frame:
+            self.update_frame()
+
+    # Set playback frame, the GUI thread only draws frames that are already decoded
     def update_frame(self):
         if self.video is None:
             return
-        frame = self[self.current_frame, self.current_annotation]
-        height, width, c = frame.shape
-        image = QImage(frame.data, width, height, c * width, QImage.Format.Format_BGR888)
-        pixmap = QPixmap.fromImage(image)
-        self.monitor.setPixmap(pixmap)
+        if self.decoder is not None:
+            self.decoder.set_playhead(self.current_frame)
+            if not self.video.is_decoded(self.current_frame) and self.decoder.isRunning() \
+                    and self.current_frame not in self.decoder.failed:
+                return
+        self.render_frame()
+
+    # Redraw the annotation overlay only, the held base frame is reused and nothing is decoded
+    def update_overlay(self):
+        if self.video is None:
+            return
+        if not self.video.is_held(self.current_frame):
+            self.update_frame()
+            return
+        self.render_frame()
+
+    # Render the current frame straight into the display buffer of the monitor
+    def render_frame(self):
+        canvas = self.monitor.get_canvas(self.video.get_canvas_shape())
+        self.video.render(self.current_frame, self.current_annotation, canvas)
+        self.monitor.update()
+        if self.playback.isActive():
+            self.playback.frame_shown()
 
     # Continue playing, for play button
     def continue_play(self):
         if self.videoPlayBar.get_slider_value() == len(self) - 1:
             self.current_frame = 0
             self.videoPlayBar.set_frames_progress(self.current_frame)
-        self.timer.start()
+        self.playback.start(self.current_frame, self.video.fps, len(self))
         # self.set_show_label(False)
         self.set_show_annotation_index(False)
         self.videoPlayBar.playBtn.setPlay(True)
@@ -745,7 +1333,7 @@ class VideoFramePlayer(QWidget):
 
     # Pause
     def pause_play(self):
-        self.timer.stop()
+        self.playback.stop()
         self.set_show_annotation_index(True)
         self.videoPlayBar.playBtn.setPlay(False)
         self.PlayBtnClicked.emit(False)
@@ -753,20 +1341,24 @@ class VideoFramePlayer(QWidget):
     # Play button slot function
     def _toggle_play(self):
         if self.video is not None:
-            if self.timer.isActive():
+            if self.playback.isActive():
                 self.pause_play()
             else:
                 self.continue_play()
 
-    # Timer slot function
-    def _next_frame(self):
-        if self.current_frame >= len(self) - 1:
-            self.timer.stop()
-            self.set_show_annotation_index(True)
-            self.videoPlayBar.playBtn.setPlay(False)
-            return
-        self.current_frame += 1
-        self.videoPlayBar.set_frames_progress(self.current_frame)
+    # Playback slot function, the frame is shown without going through the slider
+    def _play_frame(self, index):
+        self.current_frame = index
+        self.videoPlayBar.progressSlider.blockSignals(True)
+        self.videoPlayBar.set_frames_progress(index)
+        self.videoPlayBar.progressSlider.blockSignals(False)
+        self.check_button()
+        self.FrameChanged.emit(index)
+        self.update_frame()
+
+    # Speed box slot function
+    def _speed_changed(self, index):
+        self.playback.set_speed(playback_speeds[index])
 
     # Switch frames forward and backward
     def switch_by_offset(self, direction: bool, step: int):
@@ -787,6 +1379,20 @@ class VideoFramePlayer(QWidget):
                     self.current_frame = len(self) - 1
                 self.update_progress()
 
+    # Switch the magnification of the close-ups, roll up to zoom in
+    def switch_zoom(self, direction: bool):
+        if self.video is None:
+            return
+        zoom_scale = self.video.get_zoom_scale()
+        if direction:
+            larger = [zoom for zoom in zoom_levels if zoom > zoom_scale]
+            zoom_scale = larger[0] if larger else zoom_scale
+        else:
+            smaller = [zoom for zoom in zoom_levels if zoom < zoom_scale]
+            zoom_scale = smaller[-1] if smaller else zoom_scale
+        self.video.set_zoom_scale(zoom_scale)
+        self.update_overlay()
+
     # Mouse switching slot function
     def switch_by_mouse(self, direction: bool):
         if direction:
@@ -839,9 +1445,46 @@ class VideoFramePlayer(QWidget):
         if self.video is None:
             return
         self.current_frame = value
+        if self.scrubbing:
+            self.update_scrub()
+            return
         self.FrameChanged.emit(self.current_frame)
         self.update_frame()
 
+    def _scrub_started(self):
+        if self.video is None:
+            return
+        self.pause_play()
+        self.scrubbing = True
+        self.scrub_origin = self.current_frame
+
+    # Switch to the frame under the slider once, with a full render
+    def _scrub_finished(self):
+        if not self.scrubbing:
+            return
+        self.scrubbing = False
+        self.scrub_timer.stop()
+        if self.video is None or self.current_frame == self.scrub_origin and self.video.is_held(self.current_frame):
+            return
+        self._switch_by_slider(self.videoPlayBar.get_slider_value())
+
+    # Show the newest scrub target: the frame itself if it is decoded, otherwise the nearest keyframe preview.
+    # Only the newest target is decoded, older ones are dropped by the decoder or the coalescing timer
+    def update_scrub(self):
+        if self.decoder is not None:
+            self.decoder.set_playhead(self.current_frame)
+        if self.video.is_decoded(self.current_frame):
+            self.render_frame()
+            return
+        if self.video.render_preview(self.current_frame, self.monitor.get_canvas(self.video.get_canvas_shape())):
+            self.monitor.update()
+        if self.decoder is None or not self.decoder.isRunning():
+            self.scrub_timer.start()
+
+    def _scrub_render(self):
+        if self.video is not None and self.scrubbing:
+            self.render_frame()
+
     # Keyframe indicator slot function
     def _switch_by_marker(self, index):
         if self.video is None:
@@ -850,6 +1493,12 @@ class VideoFramePlayer(QWidget):
         self.current_frame = index
         self.update_progress()
 
+    # Keyframe indicator thumbnail, from the keyframe store of the current video
+    def _get_marker_thumbnail(self, index):
+        if self.video is None:
+            return None
+        return self.video.get_keyframe_thumbnail(index)
+
     # Get auto-fill settings
     def get_auto_fill_setting(self):
         return self.auto_fill_setting
@@ -868,7 +1517,7 @@ class VideoFramePlayer(QWidget):
         if self.current_frame not in keyframe_list:
             return
         self.video.auto_fill(self.current_frame, self.auto_fill_setting)
-        self.update_frame()
+        self.update_overlay()
         self.AnnotationAutoFilled.emit(self.current_frame)
 
     # Simplify annotation
@@ -919,33 +1568,45 @@ class VideoFramePlayer(QWidget):
         return self.video.get_annotation(index)
 
     def insert_annotation(self, index):
+        if self.video is None:
+            return
         self.video.annotation_insert(frame_index=self.current_frame, annotation_index=index)
-        self.update_frame()
+        self.update_overlay()
 
     def append_annotation(self):
+        if self.video is None:
+            return
         self.video.annotation_append(frame_index=self.current_frame)
-        self.update_frame()
+        self.update_overlay()
 
     def delete_annotation(self, index):
+        if self.video is None:
+            return
         self.video.annotation_delete(frame_index=self.current_frame, annotation_index=index)
-        self.update_frame()
+        self.update_overlay()
 
     def set_annotation(self, point):
+        if self.video is None:
+            return
         self.video.set_annotation(frame_index=self.current_frame, annotation_index=self.current_annotation, point=point)
-        self.update_frame()
+        self.update_overlay()
 
     def set_prompt_annotation(self, frame_index, annotation_index, annotation):
         self.video.set_prompt_annotation(frame_index=frame_index, annotation_index=annotation_index,
                                          annotation=annotation)
 
     def fix_annotation(self, direction, step):
+        if self.video is None:
+            return
         self.video.fix_annotation(frame_index=self.current_frame, annotation_index=self.current_annotation,
                                   direction=direction, step=step)
-        self.update_frame()
+        self.update_overlay()
 
     def cancel_annotation(self):
+        if self.video is None:
+            return
         self.video.cancel_annotation(frame_index=self.current_frame, annotation_index=self.current_annotation)
-        self.update_frame()
+        self.update_overlay()
 
     # General function
     def resizeEvent(self, event):
@@ -954,8 +1615,7 @@ class VideoFramePlayer(QWidget):
         self.keyframeIndicator.resize(progress_bar_len=slider_width)
 
     def closeEvent(self, event):
-        if self.video is not None:
-            del self.video
+        self.release_video()
         event.accept()
 
 
@@ -0,0 +1,45 @@
+import os
+import hashlib
+
+import cv2
+
+from ui.VideoMeta import get_file_stamp
+
+# Folder of the video posters, one small JPEG per video shown while browsing the dataset
+poster_dir = os.path.join(os.path.expanduser('~'), '.cache', 'EVA', 'posters')
+poster_width = 160
+poster_quality = 80
+
+
+# Poster file of a video, from the video path, size and modification time
+def get_poster_path(video_path):
+    stamp = get_file_stamp(video_path)
+    key = '{}|{}|{}'.format(os.path.abspath(video_path), stamp['size'], stamp['mtime'])
+    return os.path.join(poster_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.jpg')
+
+
+# Save the poster of a video from one of its frames, written under a temporary name so a reader never sees half a file
+def save_poster(video_path, frame):
+    height = max(int(frame.shape[0] * poster_width / frame.shape[1]), 1)
+    poster = cv2.resize(frame, (poster_width, height), interpolation=cv2.INTER_AREA)
+    s, buffer = cv2.imencode('.jpg', poster, [cv2.IMWRITE_JPEG_QUALITY, poster_quality])
+    if not s:
+        return
+    try:
+        poster_path = get_poster_path(video_path)
+        os.makedirs(poster_dir, exist_ok=True)
+        temp_path = poster_path + '.part'
+        with open(temp_path, 'wb') as f:
+            f.write(buffer.tobytes())
+        os.replace(temp_path, poster_path)
+    except OSError:
+        pass
+
+
+# Encoded poster of a video, None if it has not been made yet. The video itself is never opened
+def load_poster(video_path):
+    try:
+        with open(get_poster_path(video_path), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
@@ -0,0 +1,106 @@
+import threading
+
+from ui.FrameSource import open_frame_source
+from ui.VideoMeta import load_log_data
+
+# Keyframes decoded ahead from the start of each neighbouring video
+prefetch_keyframes = (0, 30, 60)
+
+
+# Open a video the way VideoManager does: open and probe the frame source, read the annotation log and decode the
+# first keyframes. The GOP index is left to VideoManager, which builds it in the background once the video is shown
+def prefetch_video(video_path, log_path, stop_event=None):
+    source = open_frame_source(video_path)
+    try:
+        meta = source.probe(log_path)
+        log_data = load_log_data(log_path)
+        frames = {}
+        for index in prefetch_keyframes:
+            if index >= meta['length'] or (stop_event is not None and stop_event.is_set()):
+                break
+            frame = source.read(index)
+            if frame is None:
+                break
+            frames[index] = frame
+    except Exception:
+        source.release()
+        raise
+    return {'video_path': video_path, 'log_path': log_path, 'source': source, 'meta': meta,
+            'log_data': log_data, 'frames': frames}
+
+
+def release_prefetched(prefetched):
+    prefetched['source'].release()
+
+
+# Background thread keeping the neighbours of the current video opened, so switching to them skips the
+# capture open, the probe and the first decodes
+class VideoPrefetcher(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        # (video path, log path) pairs that should be kept ready, and the prefetched ones by video path
+        self.wanted = []
+        self.ready = {}
+        self.failed = set()
+
+    # Keep exactly these videos ready, prefetched videos that are no longer wanted are released
+    def request(self, video_list):
+        with self.condition:
+            self.wanted = list(video_list)
+            wanted_paths = set(video_path for video_path, _ in self.wanted)
+            for video_path in [k for k in self.ready if k not in wanted_paths]:
+                release_prefetched(self.ready.pop(video_path))
+            self.condition.notify()
+        if self.ident is None and not self.stop_event.is_set():
+            self.start()
+
+    # Take a prefetched video, None if it is not ready. The caller owns its frame source
+    def take(self, video_path, log_path):
+        with self.condition:
+            prefetched = self.ready.pop(video_path, None)
+            self.wanted = [item for item in self.wanted if item[0] != video_path]
+        if prefetched is not None and prefetched['log_path'] != log_path:
+            release_prefetched(prefetched)
+            return None
+        return prefetched
+
+    def clear(self):
+        self.request([])
+
+    def stop(self):
+        with self.condition:
+            self.stop_event.set()
+            self.condition.notify()
+        if self.is_alive():
+            self.join()
+        self.clear()
+
+    def _next_video(self):
+        for video_path, log_path in self.wanted:
+            if video_path not in self.ready and video_path not in self.failed:
+                return video_path, log_path
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                target = self._next_video()
+                while target is None and not self.stop_event.is_set():
+                    self.condition.wait()
+                    target = self._next_video()
+                if self.stop_event.is_set():
+                    break
+            try:
+                prefetched = prefetch_video(*target, stop_event=self.stop_event)
+            # Unreadable or corrupt videos, e.g. cv2.error or a ValueError from broken metadata
+            except Exception:
+                self.failed.add(target[0])
+                continue
+            with self.condition:
+                if target in self.wanted and not self.stop_event.is_set():
+                    self.ready[target[0]] = prefetched
+                    prefetched = None
+            if prefetched is not None:
+                release_prefetched(prefetched)
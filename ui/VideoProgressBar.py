@@ -1,4 +1,5 @@
 import sys
+import base64
 import cv2
 from enum import Enum
 from PyQt6.QtWidgets import (
@@ -7,7 +8,7 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt, QSize
 
-from qfluentwidgets import (TransparentToolButton, ToolTipFilter, Slider)
+from qfluentwidgets import (TransparentToolButton, ToolTipFilter, Slider, ComboBox, CaptionLabel)
 from qfluentwidgets import FluentIcon as FIF
 
 
@@ -65,10 +66,13 @@ class NextButton(MediaPlayBarButton):
 
 # Keyframe switch button class
 class MarkerButton(QPushButton):
-    def __init__(self, index, callback=None):
+    def __init__(self, index, callback=None, thumbnail_callback=None):
         super().__init__()
         self.index = index
         self.callback = callback
+        self.thumbnail_callback = thumbnail_callback
+        self.has_thumbnail = False
+        self.setToolTip(str(index))
         self.setFixedSize(16, 16)
         self.setCursor(Qt.CursorShape.PointingHandCursor)
         self.status = "default"
@@ -77,6 +81,17 @@ class MarkerButton(QPushButton):
 
         self.clicked.connect(lambda: callback(self.index)) if callback else None
 
+    # Show the keyframe thumbnail in the tooltip once it has been decoded
+    def enterEvent(self, event):
+        if self.thumbnail_callback is not None and not self.has_thumbnail:
+            thumbnail = self.thumbnail_callback(self.index)
+            s, buffer = (False, None) if thumbnail is None else cv2.imencode('.png', thumbnail)
+            if s:
+                self.setToolTip('<img src="data:image/png;base64,{}"><br>{}'.format(
+                    base64.b64encode(buffer.tobytes()).decode('ascii'), self.index))
+                self.has_thumbnail = True
+        super().enterEvent(event)
+
     def setStatus(self, status: Status):
         """设置按钮状态颜色，例如：'default', 'working', 'error', 'success'"""
         self.status = status.value()
@@ -126,9 +141,10 @@ class MarkerButton(QPushButton):
 # Keyframe indicator bar class
 class MarkerOverlay(QWidget):
 
-    def __init__(self, parent, keyframe_list=None, jump_callback=None):
+    def __init__(self, parent, keyframe_list=None, jump_callback=None, thumbnail_callback=None):
         super().__init__(parent)
         self.jump_callback = jump_callback
+        self.thumbnail_callback = thumbnail_callback
         if keyframe_list is None:
             self.index_list = [0, 20, 40, 60, 80, 100]
         else:
@@ -162,7 +178,7 @@ class MarkerOverlay(QWidget):
     # Readd
     def add_marker_buttons(self, progress_bar_len=400):
         for index, frame_num in enumerate(self.index_list):
-            mark = MarkerButton(frame_num, self.jump_callback)
+            mark = MarkerButton(frame_num, self.jump_callback, self.thumbnail_callback)
             self.layout.addWidget(mark, stretch=0)
             if index != len(self.index_list) - 1:
                 gap = self.index_list[index + 1] - self.index_list[index]
@@ -195,6 +211,17 @@ class MarkerOverlay(QWidget):
         self.buttons[key_frame_index].setStatus(status=status)
 
 
+# Frame slider that also reports groove clicks and drags as scrubs, the fluent Slider only does it for its handle
+class ScrubSlider(Slider):
+    def mousePressEvent(self, e):
+        self.sliderPressed.emit()
+        super().mousePressEvent(e)
+
+    def mouseReleaseEvent(self, e):
+        super().mouseReleaseEvent(e)
+        self.sliderReleased.emit()
+
+
 # Video playback progress bar class
 class VideoPlayBar(QWidget):
     def __init__(self, parent):
@@ -206,15 +233,20 @@ class VideoPlayBar(QWidget):
 
         self.playBtn = PlayButton()
         self.preBtn = PreviousButton()
-        self.progressSlider = Slider(Qt.Orientation.Horizontal, self)
+        self.progressSlider = ScrubSlider(Qt.Orientation.Horizontal, self)
         self.progressSlider.setMinimum(0)
         self.progressSlider.setMinimumWidth(400)
         self.nextBtn = NextButton()
+        self.fpsLabel = CaptionLabel('')
+        self.fpsLabel.setMinimumWidth(80)
+        self.speedBox = ComboBox(self)
 
         self.hBoxLayout.addWidget(self.playBtn)
         self.hBoxLayout.addWidget(self.preBtn)
         self.hBoxLayout.addWidget(self.progressSlider)
         self.hBoxLayout.addWidget(self.nextBtn)
+        self.hBoxLayout.addWidget(self.fpsLabel)
+        self.hBoxLayout.addWidget(self.speedBox)
 
         # self.setFixedHeight(48)
 
@@ -230,6 +262,15 @@ class VideoPlayBar(QWidget):
     def get_slider_width(self):
         return self.progressSlider.width()
 
+    def set_speed_list(self, speed_list, speed):
+        self.speedBox.clear()
+        self.speedBox.addItems(['{:g}x'.format(item) for item in speed_list])
+        self.speedBox.setCurrentIndex(speed_list.index(speed))
+
+    # Show the achieved frame rate against the target frame rate
+    def set_fps_info(self, achieved_fps, target_fps):
+        self.fpsLabel.setText('{:.1f}/{:.1f} fps'.format(achieved_fps, target_fps))
+
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,148 @@
+import os
+import hashlib
+import threading
+from collections import deque
+
+import cv2
+from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtGui import QGuiApplication
+
+from ui.FrameSource import open_frame_source
+from ui.VideoMeta import VideoOpenError, get_file_stamp
+
+# Folder of the proxy videos
+proxy_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'EVA', 'proxy')
+# JPEG quality of the proxy frames
+proxy_quality = 90
+
+
+# Height of the proxies: the available height of the screen, the display of a whole frame is never taller.
+# Must be called from the GUI thread
+def get_proxy_height():
+    screen = QGuiApplication.primaryScreen()
+    return screen.availableGeometry().height() // 2 * 2
+
+
+# Path of the proxy of a video, keyed by the video path, size, modification time and proxy height
+def get_proxy_path(video_path, proxy_height):
+    stamp = get_file_stamp(video_path)
+    key = '{}|{}|{}|{}'.format(os.path.abspath(video_path), stamp['size'], stamp['mtime'], proxy_height)
+    return os.path.join(proxy_cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.avi')
+
+
+# Get the proxy of a video if it has been built, None otherwise
+def find_proxy(video_path, proxy_height=None):
+    try:
+        proxy_path = get_proxy_path(video_path, get_proxy_height() if proxy_height is None else proxy_height)
+    except OSError:
+        return None
+    return proxy_path if os.path.exists(proxy_path) else None
+
+
+# Transcode a video into an intra-frame (MJPG) proxy at display resolution. Every frame is a key frame,
+# so seeking costs one JPEG decode. The proxy is written under a temporary name and only kept if complete,
+# the temporary file is removed whatever stops the transcode
+def build_proxy(video_path, proxy_height, log_path=None, stop_event=None):
+    proxy_path = get_proxy_path(video_path, proxy_height)
+    if os.path.exists(proxy_path):
+        return proxy_path
+    temp_path = proxy_path[:-len('.avi')] + '.part.avi'
+    writer = None
+    complete = False
+    source = open_frame_source(video_path)
+    try:
+        meta = source.probe(log_path)
+        height = min(proxy_height, meta['height'])
+        width = int(round(meta['width'] * height / meta['height'])) // 2 * 2
+        height = height // 2 * 2
+
+        os.makedirs(proxy_cache_dir, exist_ok=True)
+        writer = cv2.VideoWriter(temp_path, cv2.VideoWriter_fourcc(*'MJPG'), meta['fps'] or 25, (width, height))
+        if not writer.isOpened():
+            raise VideoOpenError('Cannot write proxy: {}'.format(temp_path))
+        writer.set(cv2.VIDEOWRITER_PROP_QUALITY, proxy_quality)
+        frame_num = 0
+        for _, frame in source.read_range(0, meta['length']):
+            if stop_event is not None and stop_event.is_set():
+                break
+            writer.write(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+            frame_num += 1
+        # The proxy must have exactly the frames of the source, otherwise frame indices would not match
+        complete = frame_num == meta['length']
+    finally:
+        if writer is not None:
+            writer.release()
+        source.release()
+        if not complete and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if not complete:
+        return None
+    os.replace(temp_path, proxy_path)
+    return proxy_path
+
+
+# Background proxy builder, videos are transcoded one after the other in request order
+class ProxyBuilder(QThread):
+    ProxyReady = pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        # (video path, log path) pairs waiting to be built
+        self.queue = deque()
+        self.failed = set()
+        self.proxy_height = get_proxy_height()
+
+    # Queue videos, ones already waiting keep their place
+    def request(self, video_list):
+        with self.condition:
+            waiting = set(video_path for video_path, _ in self.queue)
+            for video_path, log_path in video_list:
+                if video_path not in waiting and video_path not in self.failed:
+                    self.queue.append((video_path, log_path))
+                    waiting.add(video_path)
+            self.condition.notify()
+        if not self.isRunning():
+            self.start()
+
+    # Build a video next, e.g. the one that was just opened
+    def prioritize(self, video_path, log_path):
+        with self.condition:
+            self.queue = deque(item for item in self.queue if item[0] != video_path)
+            self.queue.appendleft((video_path, log_path))
+            self.condition.notify()
+        if not self.isRunning():
+            self.start()
+
+    def clear(self):
+        with self.condition:
+            self.queue.clear()
+
+    def stop(self):
+        with self.condition:
+            self.stop_event.set()
+            self.queue.clear()
+            self.condition.notify()
+        self.wait()
+        self.stop_event.clear()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.stop_event.is_set():
+                    self.condition.wait()
+                if self.stop_event.is_set():
+                    break
+                video_path, log_path = self.queue.popleft()
+            try:
+                proxy_path = build_proxy(video_path, self.proxy_height, log_path, self.stop_event)
+            # Unreadable or corrupt videos, e.g. cv2.error or a ValueError from broken metadata
+            except Exception:
+                proxy_path = None
+            if proxy_path is None:
+                if not self.stop_event.is_set():
+                    self.failed.add(video_path)
+                continue
+            self.ProxyReady.emit(video_path, proxy_path)